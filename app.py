@@ -1,28 +1,45 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify
+import time
+_import_started = time.perf_counter()
+
+from flask import (Flask, Blueprint, current_app, g, render_template, redirect, url_for, request, flash, jsonify,
+                   get_flashed_messages, stream_template)
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_bcrypt import Bcrypt
 from datetime import datetime
-from sqlalchemy import func, or_
+from sqlalchemy import case, event, func, inspect, literal, literal_column, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+import click
+from flask.cli import with_appcontext
+import heapq
 import re
 import os
-
-
-app = Flask(__name__)
-
-# CONFIGURATION
-# Replace 'root', 'password' with your actual MySQL credentials
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
-    'DATABASE_URL',
-    'sqlite:///site.db'  # fallback for local dev
-)
-app.config['SECRET_KEY'] = 'key' # Needed for session management
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+import uuid
+
+from assets import Assets
+from catalog import CatalogSnapshot
+from db_routing import ReplicaRouter, RoutingSession, shard_of
+from professor_matching import ProfessorMatcher
+from profiling import RequestProfiler
+from review_events import ReviewEvents
+from rollups import (aggregate_columns, rating_summary, review_increments, term_columns, term_keys, trend_rows,
+                     upsert_increment)
+from schema import sync_schema
+from sharding import ShardRouter, ShardingError, chunks
+
+
+# Extensions are created unbound and attached to an app in create_app()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+bcrypt = Bcrypt()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+replica_router = ReplicaRouter()
+assets = Assets()
+profiler = RequestProfiler()
+review_events = ReviewEvents()
+
+main = Blueprint('main', __name__)
 
 # --- DATABASE MODELS (Mapping Python Classes to SQL Tables) ---
 
@@ -41,38 +58,58 @@ class Professor(db.Model):
     name = db.Column(db.String(100), nullable=False)
     department = db.Column(db.String(100))
     university = db.Column(db.String(100))
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
     reviews = db.relationship('Review', backref='professor', lazy=True)
     user = db.relationship('User', backref='professor_profile', uselist=False)
 
+def normalized_course_code(column):
+    # lower(course_code) without spaces, dashes and dots. Literals (not bound params)
+    # so queries match the expression index on reviews exactly.
+    cleaned = column
+    for ch in (' ', '-', '.'):
+        cleaned = func.replace(cleaned, literal_column(f"'{ch}'"), literal_column("''"))
+    return func.lower(cleaned)
+
 class Review(db.Model):
     __tablename__ = 'reviews'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
-    professor_id = db.Column(db.Integer, db.ForeignKey('professors.id'), nullable=False)
-    course_code = db.Column(db.String(20), nullable=False)
+    professor_id = db.Column(db.Integer, db.ForeignKey('professors.id'), nullable=False, index=True)
+    course_code = db.Column(db.String(20), nullable=False, index=True)
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.Text)
     grade = db.Column(db.String(5), nullable=True)
     semester = db.Column(db.String(10), nullable=True)
     year = db.Column(db.Integer, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Idempotency key of the form submit that created the review (see save_review)
+    submission_key = db.Column(db.String(64), nullable=True, unique=True, index=True)
     votes = db.relationship('ReviewVote', backref='review', lazy=True)
     user = db.relationship('User', backref='reviews', uselist=False)
     replies = db.relationship('ReviewReply', backref='review', lazy=True)
+    __table_args__ = (
+        db.Index('ix_reviews_course_code_normalized', normalized_course_code(course_code)),
+        # One review per user per professor, course and term; anonymous reviews (NULL user) aren't limited
+        db.Index('uq_reviews_user_course_term', user_id, professor_id, normalized_course_code(course_code),
+                 *term_columns(year, semester), unique=True),
+    )
 
 class CourseReview(db.Model):
     __tablename__ = 'course_reviews'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False, index=True)
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.Text)
     grade = db.Column(db.String(5), nullable=True)
     semester = db.Column(db.String(10), nullable=True)
     year = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    submission_key = db.Column(db.String(64), nullable=True, unique=True, index=True)
     user = db.relationship('User', backref='course_reviews', uselist=False)
+    __table_args__ = (
+        db.Index('uq_course_reviews_user_term', user_id, course_id, *term_columns(year, semester), unique=True),
+    )
 
 class Course(db.Model):
     __tablename__ = 'courses'
@@ -87,43 +124,554 @@ class ReviewVote(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     review_id = db.Column(db.Integer, db.ForeignKey('reviews.id'), nullable=False)
     vote_type = db.Column(db.Integer, nullable=False) # 1 = Like, -1 = Dislike
+    __table_args__ = (
+        db.Index('ix_review_votes_review_user', 'review_id', 'user_id'),
+    )
 
 class ReviewReply(db.Model):
     __tablename__ = 'review_replies'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
-    review_id = db.Column(db.Integer, db.ForeignKey('reviews.id'), nullable=False)
+    review_id = db.Column(db.Integer, db.ForeignKey('reviews.id'), nullable=False, index=True)
     comment = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref='replies', uselist=False)
 
+class RatingCountsMixin:
+    # Running totals for one rollup bucket; averages are rating_sum / review_count
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    grade_a = db.Column(db.Integer, nullable=False, default=0)
+    grade_b = db.Column(db.Integer, nullable=False, default=0)
+    grade_c = db.Column(db.Integer, nullable=False, default=0)
+    grade_d = db.Column(db.Integer, nullable=False, default=0)
+    grade_f = db.Column(db.Integer, nullable=False, default=0)
+    grade_other = db.Column(db.Integer, nullable=False, default=0)
+
+class ProfessorRatingRollup(RatingCountsMixin, db.Model):
+    # Per professor x course x term totals, kept up to date as reviews are added/deleted
+    __tablename__ = 'professor_rating_rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    professor_id = db.Column(db.Integer, db.ForeignKey('professors.id'), nullable=False)
+    course_code = db.Column(db.String(20), nullable=False)
+    year = db.Column(db.Integer, nullable=False, default=0)  # 0 = not given
+    semester = db.Column(db.String(10), nullable=False, default='')  # '' = not given
+    __table_args__ = (
+        db.UniqueConstraint('professor_id', 'course_code', 'year', 'semester', name='uq_professor_rating_rollup'),
+        db.Index('ix_professor_rating_rollups_course', 'course_code', 'year'),
+    )
+
+class CourseRatingRollup(RatingCountsMixin, db.Model):
+    # Per course x term totals of CourseReview rows
+    __tablename__ = 'course_rating_rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False, default=0)
+    semester = db.Column(db.String(10), nullable=False, default='')
+    __table_args__ = (
+        db.UniqueConstraint('course_id', 'year', 'semester', name='uq_course_rating_rollup'),
+    )
+
+class ProfessorSimilarity(db.Model):
+    # Precomputed "similar professors" (see recommendations.py), rebuilt by `flask recompute-similar-professors`.
+    # Global table; no foreign keys because the professors may live on different shards.
+    __tablename__ = 'professor_similarities'
+    id = db.Column(db.Integer, primary_key=True)
+    professor_id = db.Column(db.Integer, nullable=False)
+    similar_id = db.Column(db.Integer, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)  # 0 = most similar
+    score = db.Column(db.Float, nullable=False)  # cosine similarity of the feature vectors
+    __table_args__ = (
+        db.UniqueConstraint('professor_id', 'rank', name='uq_professor_similarity_rank'),
+    )
+
+class UniversityShard(db.Model):
+    # Universities that live on a shard other than the primary (see sharding.py)
+    __tablename__ = 'university_shards'
+    university_key = db.Column(db.String(100), primary_key=True)  # lower-cased, trimmed Professor.university
+    shard = db.Column(db.String(50), nullable=False)
+    moving = db.Column(db.Boolean, nullable=False, default=False)  # writes paused by move-university
+
+class ShardIdSequence(db.Model):
+    # Next id for each sharded table, so ids stay unique across shards
+    __tablename__ = 'shard_id_sequences'
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
 ## Reply model removed — no direct replies to reviews
 
+# Trigram index over professor names for "did you mean" suggestions
+professor_matcher = ProfessorMatcher(db, Professor)
+# Memory-mapped course codes / professor list shared by all workers
+catalog = CatalogSnapshot(db, Professor, Course, Review)
+# Per-university shards for professors and everything hanging off them; users and courses stay global
+shard_router = ShardRouter(db, UniversityShard, ShardIdSequence)
+shard_router.shard_by(Professor, 'university')
+shard_router.shard_with(Review, Professor, 'professor_id')
+shard_router.shard_with(ReviewVote, Review, 'review_id')
+shard_router.shard_with(ReviewReply, Review, 'review_id')
+shard_router.shard_with(ProfessorRatingRollup, Professor, 'professor_id', local_ids=True)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def flag_catalog_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Professor, Course)) or (
+                isinstance(obj, Review) and obj in session.new and catalog.is_new_course_code(obj.course_code)):
+            session.info['catalog_changed'] = True
+            return
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def refresh_catalog(session):
+    if session.info.pop('catalog_changed', False):
+        # The data is already committed; a stale catalog is better than failing the request
+        try:
+            catalog.rebuild()
+        except Exception:
+            current_app.logger.exception('Failed to rebuild the catalog snapshot')
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_catalog_changes(session):
+    session.info.pop('catalog_changed', None)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def update_rating_rollups(session, flush_context):
+    # Apply each inserted/deleted review to its rollup row in the same transaction
+    changes = [(obj, 1) for obj in session.new] + [(obj, -1) for obj in session.deleted]
+    for obj, sign in changes:
+        if isinstance(obj, Review):
+            keys = {'professor_id': obj.professor_id, 'course_code': obj.course_code, **term_keys(obj)}
+            # The rollup lives on the review's shard
+            conn = session.connection(bind_arguments={'mapper': ProfessorRatingRollup, 'instance': obj})
+            upsert_increment(conn, ProfessorRatingRollup.__table__, keys, review_increments(obj, sign))
+        elif isinstance(obj, CourseReview):
+            keys = {'course_id': obj.course_id, **term_keys(obj)}
+            upsert_increment(session.connection(), CourseRatingRollup.__table__, keys, review_increments(obj, sign))
+
+
+def review_event_data(review):
+    return {'id': review.id, 'course_code': review.course_code, 'rating': review.rating, 'comment': review.comment,
+            'grade': review.grade, 'semester': review.semester, 'year': review.year, 'created_at': review.created_at}
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_review_events(session, flush_context):
+    # Live dashboard updates; held until commit so nobody sees a review that gets rolled back
+    events = []
+    changed = {}
+    for obj in session.new:
+        if isinstance(obj, Review) and review_events.wants(f'professor:{obj.professor_id}'):
+            events.append((obj.professor_id, 'review', review_event_data(obj)))
+            changed[obj.professor_id] = obj
+        elif isinstance(obj, ReviewReply):
+            review = session.get(Review, obj.review_id)
+            if review is not None and review_events.wants(f'professor:{review.professor_id}'):
+                events.append((review.professor_id, 'reply', {'id': obj.id, 'review_id': obj.review_id,
+                                                              'comment': obj.comment, 'created_at': obj.created_at}))
+    for obj in session.deleted:
+        if isinstance(obj, Review) and review_events.wants(f'professor:{obj.professor_id}'):
+            events.append((obj.professor_id, 'review_deleted', {'id': obj.id}))
+            changed[obj.professor_id] = obj
+    # New totals straight from the rollups update_rating_rollups just wrote
+    rollups = ProfessorRatingRollup.__table__
+    for professor_id, review in changed.items():
+        conn = session.connection(bind_arguments={'mapper': ProfessorRatingRollup, 'instance': review})
+        count, total = conn.execute(select(func.sum(rollups.c.review_count), func.sum(rollups.c.rating_sum))
+                                    .where(rollups.c.professor_id == professor_id)).one()
+        events.append((professor_id, 'aggregates', {'review_count': count or 0,
+                                                    'avg_rating': round(total / count, 1) if count else 0}))
+    if events:
+        session.info.setdefault('review_events', []).extend(events)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def publish_review_events(session):
+    for professor_id, name, data in session.info.pop('review_events', []):
+        review_events.publish(f'professor:{professor_id}', name, data)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_review_events(session):
+    session.info.pop('review_events', None)
+
+
+def rebuild_rating_rollups(professor_ids=None):
+    """Recompute rollups from the review tables (all of them, or just some professors)."""
+    # Each shard's reviews roll up into that shard's rollup table
+    for shard in db.session().shard_names():
+        with db.session().on_shard(shard):
+            prof_rollups = ProfessorRatingRollup.query
+            year, semester = term_columns(Review.year, Review.semester)
+            prof_totals = (db.session.query(Review.professor_id, Review.course_code, year.label('year'),
+                                            semester.label('semester'), *aggregate_columns(Review.rating, Review.grade))
+                           .group_by(Review.professor_id, Review.course_code, year, semester))
+            if professor_ids is not None:
+                prof_rollups = prof_rollups.filter(ProfessorRatingRollup.professor_id.in_(professor_ids))
+                prof_totals = prof_totals.filter(Review.professor_id.in_(professor_ids))
+            prof_rollups.delete(synchronize_session=False)
+            rows = [row._asdict() for row in prof_totals]
+            if rows:
+                db.session.execute(ProfessorRatingRollup.__table__.insert(), rows)
+
+    if professor_ids is None:
+        CourseRatingRollup.query.delete(synchronize_session=False)
+        year, semester = term_columns(CourseReview.year, CourseReview.semester)
+        course_totals = (db.session.query(CourseReview.course_id, year.label('year'), semester.label('semester'),
+                                          *aggregate_columns(CourseReview.rating, CourseReview.grade))
+                         .group_by(CourseReview.course_id, year, semester))
+        rows = [row._asdict() for row in course_totals]
+        if rows:
+            db.session.execute(CourseRatingRollup.__table__.insert(), rows)
+    db.session.commit()
+
+
+def professor_rollups(professor_id, course_code=None):
+    query = ProfessorRatingRollup.query.filter_by(professor_id=professor_id)
+    if course_code:
+        query = query.filter_by(course_code=course_code)
+    return query.all()
+
+
+def professor_trends(professor_id, course_code=None):
+    return trend_rows(professor_rollups(professor_id, course_code))
+
+
+def course_rollups(course):
+    # Course-content review totals, and professor review totals given for this course code
+    return (CourseRatingRollup.query.filter_by(course_id=course.id).all(),
+            ProfessorRatingRollup.query.filter_by(course_code=course.code).all())
+
+
+def course_trends(course):
+    course_rows, professor_rows = course_rollups(course)
+    return {'course_reviews': trend_rows(course_rows), 'professor_reviews': trend_rows(professor_rows)}
+
+
+# The statements below are shared with asgi.py, which runs them on an async session
+def course_code_conditions(q):
+    """Conditions on Review for a course code search, best first: exact (normalized), then substring."""
+    q_norm = re.sub(r"\W+", "", q).lower()
+    return [normalized_course_code(Review.course_code) == q_norm, Review.course_code.ilike(f"%{q}%")]
+
+
+def professors_with_reviews_where(condition):
+    """SELECT id, name of the professors with a review matching `condition`."""
+    # IN (subquery) lets the planner drive from the reviews index instead of scanning professors
+    return select(Professor.id, Professor.name).where(Professor.id.in_(select(Review.professor_id).where(condition)))
+
+
+def vote_counts_where(review_id):
+    """SELECT vote_type, count of a review's votes."""
+    return (select(ReviewVote.vote_type, func.count())
+            .where(ReviewVote.review_id == review_id).group_by(ReviewVote.vote_type))
+
+
+def parse_vote_type(vote_type):
+    """The vote for a /vote URL segment ('1', '-1', 'like'/'up', 'dislike'/'down'), or None."""
+    try:
+        return int(vote_type)
+    except ValueError:
+        return {'like': 1, 'up': 1, 'dislike': -1, 'down': -1}.get(vote_type.lower())
+
+
+def professor_suggestions(existing, name, university):
+    """The likely duplicate first, then any other close matches, for re-rendering a form."""
+    return [existing] + [p for p, score in professor_matcher.suggest(name, university) if p.id != existing.id]
+
+
+def similar_professors(professor_id):
+    """[(Professor, score)] most similar first, from the precomputed table."""
+    pairs = (db.session.query(ProfessorSimilarity.similar_id, ProfessorSimilarity.score)
+             .filter(ProfessorSimilarity.professor_id == professor_id)
+             .order_by(ProfessorSimilarity.rank)
+             .all())
+    if not pairs:
+        return []
+    # Looked up separately rather than joined: neighbours can live on other shards
+    professors = {p.id: p for p in Professor.query.filter(Professor.id.in_([sid for sid, _score in pairs]))}
+    return [(professors[sid], score) for sid, score in pairs if sid in professors]
+
+
+def recompute_similar_professors(k=None):
+    """Rebuild professor_similarities from all professors and reviews; returns the number of pairs."""
+    # NumPy is only needed here, so web workers never pay for importing it
+    from recommendations import TOP_K, FeatureBuilder, top_k_similar
+
+    professors = db.session.query(Professor.id, Professor.department).order_by(Professor.id).all()
+    features = FeatureBuilder([pid for pid, _department in professors])
+    for pid, department in professors:
+        features.add_department(pid, department)
+    # Ratings and courses arrive pre-aggregated; only comments are read row by row
+    ratings = (db.session.query(Review.professor_id, Review.rating, func.count())
+               .group_by(Review.professor_id, Review.rating))
+    for pid, rating, count in ratings:
+        features.add_rating_count(pid, rating, count)
+    course_code = normalized_course_code(Review.course_code)
+    courses = (db.session.query(Review.professor_id, course_code, func.count())
+               .group_by(Review.professor_id, course_code))
+    for pid, code, count in courses:
+        features.add_course_count(pid, code, count)
+    comments = db.session.query(Review.professor_id, Review.comment).filter(Review.comment.isnot(None)).yield_per(5000)
+    features.add_comments(comments)
+
+    rows, neighbours, scores, ranks = top_k_similar(features.matrix(), features.groups(), k or TOP_K)
+    ids = features.ids
+    pairs = [{'professor_id': p, 'similar_id': n, 'rank': r, 'score': round(sc, 4)}
+             for p, n, sc, r in zip(ids[rows].tolist(), ids[neighbours].tolist(), scores.tolist(), ranks.tolist())]
+    # Replace the whole table in one transaction so pages never see it half empty
+    ProfessorSimilarity.query.delete()
+    for start in range(0, len(pairs), 10000):
+        db.session.execute(ProfessorSimilarity.__table__.insert(), pairs[start:start + 10000])
+    db.session.commit()
+    return len(pairs)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+def load_review_extras(reviews, user_id=None):
+    """Attach likes_count, dislikes_count, user_vote and replies_list to reviews.
+
+    Uses a few IN queries per 500 reviews instead of several queries per review.
+    """
+    by_id = {r.id: r for r in reviews}
+    for r in reviews:
+        r.likes_count = r.dislikes_count = r.user_vote = 0
+        r.replies_list = []
+    ids = list(by_id)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        counts = (db.session.query(ReviewVote.review_id, ReviewVote.vote_type, func.count())
+                  .filter(ReviewVote.review_id.in_(chunk))
+                  .group_by(ReviewVote.review_id, ReviewVote.vote_type))
+        for review_id, vote_type, n in counts:
+            if vote_type == 1:
+                by_id[review_id].likes_count = n
+            elif vote_type == -1:
+                by_id[review_id].dislikes_count = n
+        if user_id:
+            mine = (db.session.query(ReviewVote.review_id, ReviewVote.vote_type)
+                    .filter(ReviewVote.review_id.in_(chunk), ReviewVote.user_id == user_id))
+            for review_id, vote_type in mine:
+                by_id[review_id].user_vote = vote_type
+        chunk_replies = (ReviewReply.query.filter(ReviewReply.review_id.in_(chunk))
+                         .order_by(ReviewReply.created_at.asc()))
+        for reply in chunk_replies:
+            by_id[reply.review_id].replies_list.append(reply)
+
+
+# Put this comment in a streamed template where the output so far should go out at once
+FLUSH_MARKER = '<!-- flush -->'
+
+
+def stream_page(template_name, **context):
+    """Render a template as a streamed response (or in one piece when STREAM_PAGES is off).
+
+    Context values can be generators (see iter_reviews), so rows are read from the
+    database while the page is being sent. Output goes out in STREAM_BUFFER_SIZE
+    pieces, and everything up to a FLUSH_MARKER is sent immediately.
+    """
+    if not current_app.config['STREAM_PAGES']:
+        return render_template(template_name, **context)
+    size = current_app.config['STREAM_BUFFER_SIZE']
+    # The session cookie goes out with the headers, before the template reads the flashed
+    # messages; take them out of the session now (the template gets the same list)
+    get_flashed_messages()
+    # Called here, inside the request, so the template keeps the request context while it streams
+    texts = stream_template(template_name, **context)
+
+    def pieces():
+        buffer, length = [], 0
+        for text in texts:
+            buffer.append(text)
+            length += len(text)
+            if length >= size or FLUSH_MARKER in text:
+                yield ''.join(buffer)
+                buffer, length = [], 0
+        if buffer:
+            yield ''.join(buffer)
+
+    return current_app.response_class(pieces(), mimetype='text/html')
+
+
+def iter_chunks(query):
+    """Run `query` once and yield its results in lists of STREAM_CHUNK_SIZE, fetched as needed."""
+    size = current_app.config['STREAM_CHUNK_SIZE']
+    chunk = []
+    for row in query.yield_per(size):
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_reviews(query, user_id=None, shard=None):
+    """Reviews from `query`, given their votes and replies one chunk at a time.
+
+    `shard` keeps all of it on one professor's shard (None: unsharded, or every shard).
+    """
+    for chunk in iter_chunks(query.execution_options(identity_token=shard)):
+        with db.session().on_shard(shard):
+            load_review_extras(chunk, user_id)
+        yield from chunk
+
+
+def with_replies(reviews, replies):
+    """Set replies_list from a reply stream sorted in the same review order (a merge join)."""
+    replies = iter(replies)
+    pending = next(replies, None)
+    for review in reviews:
+        review.replies_list = []
+        while pending is not None and pending.review_id == review.id:
+            review.replies_list.append(pending)
+            pending = next(replies, None)
+        yield review
+
+
+@main.app_template_global()
+def new_submission_key():
+    # Hidden field in the review forms; a resubmitted form sends the same key again
+    return uuid.uuid4().hex
+
+
+def submission_key():
+    """Idempotency key of this submit: an Idempotency-Key header or the form's hidden field."""
+    key = (request.headers.get('Idempotency-Key') or request.form.get('submission_key') or '').strip()
+    return key[:64] or None
+
+
+def submitted_review(model, key):
+    """The Review/CourseReview an earlier submit with this idempotency key created, if any."""
+    if not key:
+        return None
+    return model.query.filter_by(submission_key=key).first()
+
+
+def existing_review(user_id, professor_id, course_code, semester=None, year=None):
+    """The user's review of this professor, course and term, if they already wrote one."""
+    if user_id is None:
+        return None
+    review_year, review_semester = term_columns(Review.year, Review.semester)
+    return (Review.query
+            .filter(Review.user_id == user_id, Review.professor_id == professor_id,
+                    normalized_course_code(Review.course_code) == normalized_course_code(literal(course_code)),
+                    review_year == (year or 0), review_semester == (semester or ''))
+            .first())
+
+
+def existing_course_review(user_id, course_id, semester=None, year=None):
+    review_year, review_semester = term_columns(CourseReview.year, CourseReview.semester)
+    return (CourseReview.query
+            .filter(CourseReview.user_id == user_id, CourseReview.course_id == course_id,
+                    review_year == (year or 0), review_semester == (semester or ''))
+            .first())
+
+
+def already_reviewed_message(what, semester=None, year=None):
+    term = ' '.join(str(part) for part in (semester, year) if part)
+    return f'You have already reviewed {what}{" for " + term if term else ""}.'
+
+
+def save_review(review, key, existing):
+    """Commit a new Review/CourseReview tagged with the submit's idempotency key.
+
+    Returns (review, conflict). If a unique index refuses the row, the transaction
+    is rolled back and the row that got there first is returned instead: the same
+    submit's review when a concurrent resubmit won (conflict False), or the user's
+    other review of this course and term, looked up by `existing()` (conflict True).
+    """
+    review.submission_key = key
+    db.session.add(review)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        resubmitted = submitted_review(type(review), key)
+        if resubmitted is not None:
+            return resubmitted, False
+        winner = existing()
+        if winner is None:
+            raise
+        return winner, True
+    return review, False
+
+
+def review_duplicates(professor_ids=None, into=None):
+    """{review id: id of the review it duplicates} under the one-per-user-per-course-and-term rule.
+
+    The oldest review in each group is the one kept. With `into`, reviews of all
+    `professor_ids` count as reviews of that professor (what merging them would produce).
+    """
+    year, semester = term_columns(Review.year, Review.semester)
+    rows = (db.session.query(Review.id, Review.user_id, Review.professor_id,
+                             normalized_course_code(Review.course_code), year, semester)
+            .filter(Review.user_id.isnot(None)))
+    if professor_ids is not None:
+        rows = rows.filter(Review.professor_id.in_(professor_ids))
+    kept, duplicates = {}, {}
+    for review_id, user_id, professor_id, *course_term in sorted(rows):
+        key = (user_id, into or professor_id, *course_term)
+        if key in kept:
+            duplicates[review_id] = kept[key]
+        else:
+            kept[key] = review_id
+    return duplicates
+
+
+def remove_duplicate_reviews(duplicates):
+    """Delete duplicate reviews ({id: id kept}); their replies move to the kept review, their votes go."""
+    by_kept = {}
+    for review_id, kept_id in duplicates.items():
+        by_kept.setdefault(kept_id, []).append(review_id)
+    for kept_id, review_ids in by_kept.items():
+        (ReviewReply.query.filter(ReviewReply.review_id.in_(review_ids))
+         .update({ReviewReply.review_id: kept_id}, synchronize_session=False))
+    for chunk in chunks(list(duplicates)):
+        ReviewVote.query.filter(ReviewVote.review_id.in_(chunk)).delete(synchronize_session=False)
+        Review.query.filter(Review.id.in_(chunk)).delete(synchronize_session=False)
+    return len(duplicates)
+
+
+def course_review_duplicates():
+    """Ids of course reviews that repeat an older one by the same user for the same course and term."""
+    year, semester = term_columns(CourseReview.year, CourseReview.semester)
+    rows = (db.session.query(CourseReview.id, CourseReview.user_id, CourseReview.course_id, year, semester)
+            .filter(CourseReview.user_id.isnot(None)))
+    seen, duplicates = set(), []
+    for review_id, *key in sorted(rows):
+        if tuple(key) in seen:
+            duplicates.append(review_id)
+        else:
+            seen.add(tuple(key))
+    return duplicates
+
 # --- ROUTES ---
 
-@app.route('/')
+@main.route('/')
 def home():
-    # Show list of all professors
-    professors = Professor.query.all()
+    # Show list of all professors (from the shared catalog snapshot)
+    professors = catalog.professors()
     # If the logged-in user is a professor, show their dashboard as home
     # unless they specifically request to view other professors using '?view=others'
     if current_user.is_authenticated and getattr(current_user, 'role', None) == 'professor' and request.args.get('view') != 'others':
-        return redirect(url_for('professor_dashboard'))
+        return redirect(url_for('main.professor_dashboard'))
     
     # Get course count for the homepage
     total_courses = Course.query.count()
-    total_reviews = Review.query.count() + CourseReview.query.count()
+    # One count row per shard when professors are sharded
+    total_reviews = sum(n for (n,) in db.session.query(func.count(Review.id))) + CourseReview.query.count()
     
     return render_template('index.html', 
                          professors=professors, 
                          total_courses=total_courses,
                          total_reviews=total_reviews)
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -140,27 +688,35 @@ def register():
         university = request.form.get('university')
 
         # Debugging: show captured values (do NOT print password in production)
-        app.logger.debug(f"Register form data — username={username}, email={email}, password_provided={bool(password)}")
+        current_app.logger.debug(f"Register form data — username={username}, email={email}, password_provided={bool(password)}")
 
         # Basic validation
         if not username or not password:
             flash('Username and password are required.', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         # If professor, require professor name
         if role == 'professor' and not prof_name:
             flash('Professor name is required for professor signups.', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         # Prevent duplicate usernames
         if User.query.filter_by(username=username).first():
             flash('Username already exists. Please choose another.', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
+
+        if role == 'professor' and not request.form.get('confirm_new'):
+            existing = professor_matcher.find_duplicate(prof_name, university)
+            if existing:
+                flash(f'A profile for {existing.name} ({existing.university or "unknown university"}) already exists. '
+                      'If that is not you, tick "This is a different professor", re-enter your password and sign up again.', 'warning')
+                return render_template('register.html', suggestions=professor_suggestions(existing, prof_name, university),
+                                       form=request.form)
 
         # If email provided, check duplicates
         if email and User.query.filter_by(email=email).first():
             flash('Email already registered. Please use another or log in.', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         # Hash the password
         hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
@@ -172,9 +728,9 @@ def register():
             db.session.commit()
         except Exception as e:
             db.session.rollback()
-            app.logger.exception('Failed to create user')
+            current_app.logger.exception('Failed to create user')
             flash('Failed to create account. Please try again.', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         # If professor, create profile, auto-login, and redirect to dashboard
         if role == 'professor':
@@ -184,20 +740,20 @@ def register():
                 db.session.commit()
             except Exception as e:
                 db.session.rollback()
-                app.logger.exception('Failed to create professor profile')
+                current_app.logger.exception('Failed to create professor profile')
                 flash('Failed to create professor profile. Please try again.', 'danger')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
             login_user(new_user)
             flash('Professor account created! Welcome to your dashboard.', 'success')
-            return redirect(url_for('professor_dashboard'))
+            return redirect(url_for('main.professor_dashboard'))
 
         # Otherwise, treat as student: auto-login and redirect to home
         login_user(new_user)
         flash('Account created! You are now logged in.', 'success')
-        return redirect(url_for('home'))
-    return render_template('register.html')
+        return redirect(url_for('main.home'))
+    return render_template('register.html', suggestions=[], form={})
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         user = User.query.filter_by(username=request.form.get('username')).first()
@@ -205,65 +761,67 @@ def login():
             login_user(user)
             # If professor, go to dashboard; otherwise go to home
             if getattr(user, 'role', None) == 'professor':
-                return redirect(url_for('professor_dashboard'))
-            return redirect(url_for('home'))
+                return redirect(url_for('main.professor_dashboard'))
+            return redirect(url_for('main.home'))
         else:
             flash('Login Failed. Check username and password.', 'danger')
     return render_template('login.html')
 
-@app.route('/logout')
+@main.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
-@app.route('/professor/<int:id>', methods=['GET', 'POST'])
+@main.route('/professor/<int:id>', methods=['GET', 'POST'])
 def professor_detail(id):
     professor = Professor.query.get_or_404(id)
-    
-    # Filter Logic
-    course_filter = request.args.get('course')
-    if course_filter:
-        reviews = Review.query.filter_by(professor_id=id, course_code=course_filter).all()
-    else:
-        # make a copy so we can sort safely
-        reviews = list(professor.reviews)
+    shard = shard_of(professor)
 
-    # Calculate Average Rating
-    avg_rating = 0
-    if reviews:
-        avg_rating = sum([r.rating for r in reviews]) / len(reviews)
+    # The header's totals and trends come from the rollups, so they go out before any review is read
+    course_filter = request.args.get('course')
+    with db.session().on_shard(shard):
+        rollups = professor_rollups(id, course_filter)
+    review_count, avg_rating = rating_summary(rollups)
 
-    # Add vote counts and user_vote to each review for the template
-    for r in reviews:
-        r.likes_count = ReviewVote.query.filter_by(review_id=r.id, vote_type=1).count()
-        r.dislikes_count = ReviewVote.query.filter_by(review_id=r.id, vote_type=-1).count()
-        if current_user.is_authenticated:
-            v = ReviewVote.query.filter_by(review_id=r.id, user_id=current_user.id).first()
-            r.user_vote = v.vote_type if v else 0
-        else:
-            r.user_vote = 0
-        # Load replies for each review
-        r.replies_list = ReviewReply.query.filter_by(review_id=r.id).order_by(ReviewReply.created_at.asc()).all()
+    reviews = Review.query.filter_by(professor_id=id)
+    if course_filter:
+        reviews = reviews.filter_by(course_code=course_filter)
 
-    # Sorting: support ?sort=most_positive or ?sort=most_negative
+    # Sorting: support ?sort=most_positive or ?sort=most_negative, done in SQL so reviews can stream
     sort = request.args.get('sort', '')
-    if sort == 'most_positive':
-        # prioritize higher rating then more likes, most recent first
-        reviews.sort(key=lambda r: (r.rating, r.likes_count, r.created_at), reverse=True)
-    elif sort == 'most_negative':
-        # prioritize lower rating then more dislikes; show most critical first
-        reviews.sort(key=lambda r: (r.rating, -r.dislikes_count, r.created_at))
+    if sort in ('most_positive', 'most_negative'):
+        votes = (db.session.query(ReviewVote.review_id,
+                                  func.sum(case((ReviewVote.vote_type == 1, 1), else_=0)).label('likes'),
+                                  func.sum(case((ReviewVote.vote_type == -1, 1), else_=0)).label('dislikes'))
+                 .join(Review, Review.id == ReviewVote.review_id)
+                 .filter(Review.professor_id == id)
+                 .group_by(ReviewVote.review_id)
+                 .subquery())
+        reviews = reviews.outerjoin(votes, votes.c.review_id == Review.id)
+        if sort == 'most_positive':
+            # prioritize higher rating then more likes, most recent first
+            reviews = reviews.order_by(Review.rating.desc(), func.coalesce(votes.c.likes, 0).desc(),
+                                       Review.created_at.desc())
+        else:
+            # prioritize lower rating then more dislikes; show most critical first
+            reviews = reviews.order_by(Review.rating.asc(), func.coalesce(votes.c.dislikes, 0).desc(),
+                                       Review.created_at.asc())
+    else:
+        reviews = reviews.order_by(Review.id)
 
-    return render_template('professor_detail.html', professor=professor, reviews=reviews, avg_rating=round(avg_rating, 1), sort=sort)
+    user_id = current_user.id if current_user.is_authenticated else None
+    return stream_page('professor_detail.html', professor=professor, reviews=iter_reviews(reviews, user_id, shard),
+                       review_count=review_count, avg_rating=avg_rating, sort=sort, trends=trend_rows(rollups),
+                       similar=similar_professors(id))
 
 
-@app.route('/search')
+@main.route('/search')
 def search():
     q = request.args.get('q', '')
     q_stripped = (q or '').strip()
     if not q_stripped:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     # Professors matching name, department, or university
     profs_by_name = Professor.query.filter(Professor.name.ilike(f"%{q_stripped}%")).all()
@@ -273,15 +831,18 @@ def search():
     q_norm = re.sub(r"\W+", "", q_stripped).lower()
 
     # Build a SQL expression that removes common separators from course_code and lowercases it
-    cleaned_course = func.lower(func.replace(func.replace(func.replace(Review.course_code, ' ', ''), '-', ''), '.', ''))
+    cleaned_course = normalized_course_code(Review.course_code)
 
     # Find reviews where cleaned course_code contains the normalized query
+    # The professors come in with one IN query (per shard) instead of one query per review
     reviews_by_course = []
     if q_norm:
-        reviews_by_course = Review.query.filter(cleaned_course.ilike(f"%{q_norm}%")).all()
+        reviews_by_course = (Review.query.options(selectinload(Review.professor))
+                             .filter(cleaned_course.ilike(f"%{q_norm}%")).all())
 
     # Also search review comments for the query (helps match subjects mentioned in reviews)
-    reviews_by_comment = Review.query.filter(Review.comment.ilike(f"%{q_stripped}%")).all()
+    reviews_by_comment = (Review.query.options(selectinload(Review.professor))
+                          .filter(Review.comment.ilike(f"%{q_stripped}%")).all())
 
     # Combine review results
     reviews = {r.id: r for r in (reviews_by_course + reviews_by_comment)}
@@ -307,7 +868,22 @@ def search():
     for pid, p in profs_by_course.items():
         profs_dict[pid] = p
 
-    combined_profs = list(profs_dict.values())
+    # Shards answer independently, so rank the merged results here instead of relying on row order
+    q_lower = q_stripped.lower()
+
+    def relevance(p):
+        name = (p.name or '').lower()
+        if any(word.startswith(q_lower) for word in [name] + name.split()):
+            score = 3
+        elif q_lower in name:
+            score = 2
+        elif p.id in profs_by_course:
+            score = 1
+        else:
+            score = 0
+        return (-score, name, p.id)
+
+    combined_profs = sorted(profs_dict.values(), key=relevance)
 
     # Convert course map to list for template
     course_list = []
@@ -322,13 +898,14 @@ def search():
         )
     ).all()
     
-    # Calculate average ratings for courses
+    # Average ratings from the course rollups, one query for all matched courses
+    course_rollups_by_id = {}
+    if course_results:
+        for row in CourseRatingRollup.query.filter(CourseRatingRollup.course_id.in_([c.id for c in course_results])):
+            course_rollups_by_id.setdefault(row.course_id, []).append(row)
     for course in course_results:
-        if course.reviews:
-            avg = sum([r.rating for r in course.reviews]) / len(course.reviews)
-            course.avg_rating = round(avg, 1)
-        else:
-            course.avg_rating = None
+        review_count, avg_rating = rating_summary(course_rollups_by_id.get(course.id, []))
+        course.avg_rating = avg_rating if review_count else None
 
     return render_template('search_results.html', 
                          query=q_stripped, 
@@ -336,7 +913,7 @@ def search():
                          courses=course_list,
                          course_results=course_results)
 
-@app.route('/api/professors_for_course')
+@main.route('/api/professors_for_course')
 def professors_for_course():
     # Return JSON list of professors who have reviews for the given course code
     q = request.args.get('q', '')
@@ -344,30 +921,26 @@ def professors_for_course():
     if not q_stripped:
         return jsonify([])
 
-    # Normalize course code for matching
-    q_norm = re.sub(r"\W+", "", q_stripped).lower()
-    cleaned_course = func.lower(func.replace(func.replace(func.replace(Review.course_code, ' ', ''), '-', ''), '.', ''))
-
+    # Exact normalized matches first, then a case-insensitive contains match
     profs = {}
-    # First try exact normalized matches
-    matched = Review.query.filter(cleaned_course == q_norm).all()
-    for r in matched:
-        if r.professor:
-            profs[r.professor.id] = r.professor.name
-
-    # Fallback: case-insensitive contains match
-    if not profs:
-        matched2 = Review.query.filter(Review.course_code.ilike(f"%{q_stripped}%")).all()
-        for r in matched2:
-            if r.professor:
-                profs[r.professor.id] = r.professor.name
+    for condition in course_code_conditions(q_stripped):
+        profs = dict(db.session.execute(professors_with_reviews_where(condition)).all())
+        if profs:
+            break
 
     out = [{'id': pid, 'name': name} for pid, name in profs.items()]
     return jsonify(out)
 
-@app.route('/rate_class', methods=['GET', 'POST'])
+@main.route('/rate_class', methods=['GET', 'POST'])
 def rate_class():
     if request.method == 'POST':
+        # A resubmitted form gets the original result without writing again
+        key = submission_key()
+        done = submitted_review(Review, key)
+        if done:
+            flash('Class rating submitted.', 'success')
+            return redirect(url_for('main.professor_detail', id=done.professor_id))
+
         course = (request.form.get('course') or '').strip()
         # If the form used the 'Other' course field, it will post 'course'=='__other__' and the
         # real value will be in 'course_other'. Prefer that when present.
@@ -380,13 +953,13 @@ def rate_class():
 
         if not course or not rating_val:
             flash('Course and rating are required.', 'danger')
-            return redirect(url_for('rate_class'))
+            return redirect(url_for('main.rate_class'))
 
         try:
             rating = int(rating_val)
         except ValueError:
             flash('Invalid rating.', 'danger')
-            return redirect(url_for('rate_class'))
+            return redirect(url_for('main.rate_class'))
 
         professor_id = None
         # Existing professor selected
@@ -395,7 +968,7 @@ def rate_class():
                 professor_id = int(professor_choice)
                 if not Professor.query.get(professor_id):
                     flash('Selected professor not found.', 'danger')
-                    return redirect(url_for('rate_class'))
+                    return redirect(url_for('main.rate_class'))
             except ValueError:
                 professor_id = None
 
@@ -410,24 +983,38 @@ def rate_class():
 
             if not prof_name:
                 flash('Professor name is required when adding a new professor.', 'danger')
-                return redirect(url_for('rate_class'))
+                return redirect(url_for('main.rate_class'))
+
+            # Don't split reviews across "Dr. Jane Doe" and "Jane Doe" unless the user says so
+            existing = professor_matcher.find_duplicate(prof_name, university)
+            if existing and not request.form.get('confirm_new'):
+                flash(f'Did you mean {existing.name} ({existing.university or "unknown university"})? '
+                      'Select them from the professor list, or tick "This is a different professor".', 'warning')
+                return render_template('rate_class.html', course_codes=catalog.review_course_codes(), selected_course=course,
+                                       suggestions=professor_suggestions(existing, prof_name, university), form=request.form)
 
             try:
                 new_prof = Professor(name=prof_name, department=department, university=university)
                 db.session.add(new_prof)
-                db.session.commit()
+                # Committed together with the review, so a resubmit that loses to the same
+                # submission_key in save_review() rolls its professor back as well
+                db.session.flush()
                 professor_id = new_prof.id
             except Exception:
                 db.session.rollback()
-                app.logger.exception('Failed to create new professor')
+                current_app.logger.exception('Failed to create new professor')
                 flash('Failed to create professor. Try again.', 'danger')
-                return redirect(url_for('rate_class'))
+                return redirect(url_for('main.rate_class'))
 
         if not professor_id:
             flash('Please select or add a professor to associate with this class.', 'danger')
-            return redirect(url_for('rate_class'))
+            return redirect(url_for('main.rate_class'))
 
         user_id = current_user.id if current_user.is_authenticated else None
+        # Fast conflict path: the unique index would refuse the insert anyway, this skips the attempt
+        if existing_review(user_id, professor_id, course):
+            flash(already_reviewed_message(f'{course} with this professor'), 'warning')
+            return redirect(url_for('main.professor_detail', id=professor_id))
         # Ensure the Course exists in Course table for future quick-selection
         try:
             existing_course = Course.query.filter(func.lower(Course.code) == course.lower()).first()
@@ -435,69 +1022,88 @@ def rate_class():
             existing_course = None
         if not existing_course:
             try:
-                new_course = Course(code=course)
-                db.session.add(new_course)
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
+                # A savepoint, so a course added concurrently doesn't undo a new professor
+                with db.session.begin_nested():
+                    db.session.add(Course(code=course))
+            except IntegrityError:
+                pass
         new_review = Review(user_id=user_id, professor_id=professor_id, course_code=course, rating=rating, comment=comment)
-        db.session.add(new_review)
-        db.session.commit()
-        flash('Class rating submitted.', 'success')
-        return redirect(url_for('professor_detail', id=professor_id))
+        review, conflict = save_review(new_review, key, lambda: existing_review(user_id, professor_id, course))
+        if conflict:
+            flash(already_reviewed_message(f'{course} with this professor'), 'warning')
+        else:
+            flash('Class rating submitted.', 'success')
+        return redirect(url_for('main.professor_detail', id=review.professor_id))
 
-    # GET: build a list of distinct course codes from reviews
-    codes = [rc[0] for rc in db.session.query(Review.course_code).distinct().all() if rc[0]]
-    codes = sorted({c.strip() for c in codes})
+    # GET: distinct course codes from reviews, precomputed in the catalog snapshot
+    codes = catalog.review_course_codes()
     selected = request.args.get('course', '')
-    return render_template('rate_class.html', course_codes=codes, selected_course=selected)
+    return render_template('rate_class.html', course_codes=codes, selected_course=selected, suggestions=[], form={})
 
 
-@app.route('/api/course_codes')
+@main.route('/api/course_codes')
 def api_course_codes():
-    # Prefer explicit Course table if populated
-    try:
-        course_rows = Course.query.order_by(Course.code.asc()).all()
-    except Exception:
-        course_rows = []
-
-    if course_rows:
-        codes = [c.code for c in course_rows]
-        return jsonify(codes)
-
-    codes = [rc[0] for rc in db.session.query(Review.course_code).distinct().all() if rc[0]]
-    codes = sorted({c.strip() for c in codes})
-    return jsonify(codes)
+    # Course table codes (or review codes when it's empty), already serialized in the snapshot
+    return current_app.response_class(catalog.course_codes_json(), mimetype='application/json')
+
+@main.route('/api/professors/suggest')
+def api_professor_suggestions():
+    # "Did you mean" lookups for the add-professor forms
+    name = (request.args.get('name') or '').strip()
+    if not name:
+        return jsonify([])
+    university = (request.args.get('university') or '').strip() or None
+    matches = professor_matcher.suggest(name, university)
+    return jsonify([{'id': p.id, 'name': p.name, 'department': p.department,
+                     'university': p.university, 'score': score} for p, score in matches])
+
+@main.route('/api/professors/<int:id>/trends')
+def api_professor_trends(id):
+    # Per-term review counts, averages and grade distribution from the rollup table
+    Professor.query.get_or_404(id)
+    return jsonify(professor_trends(id, request.args.get('course') or None))
+
+@main.route('/api/professors/<int:id>/similar')
+def api_similar_professors(id):
+    # Precomputed nearest neighbours by ratings, courses, department and review wording
+    Professor.query.get_or_404(id)
+    return jsonify([{'id': p.id, 'name': p.name, 'department': p.department,
+                     'university': p.university, 'score': score} for p, score in similar_professors(id)])
+
+@main.route('/api/courses/<string:course_code>/trends')
+def api_course_trends(course_code):
+    course = Course.query.filter_by(code=course_code).first_or_404()
+    return jsonify(course_trends(course))
 
-@app.route('/review/<int:review_id>/reply', methods=['POST'])
+@main.route('/review/<int:review_id>/reply', methods=['POST'])
 @login_required
 def add_reply(review_id):
     review = Review.query.get_or_404(review_id)
     comment = request.form.get('reply_comment')
     if not comment or comment.strip() == '':
         flash('Reply cannot be empty.', 'danger')
-        return redirect(url_for('professor_detail', id=review.professor_id))
+        return redirect(url_for('main.professor_detail', id=review.professor_id))
     user_id = current_user.id if current_user.is_authenticated else None
     new_reply = ReviewReply(user_id=user_id, review_id=review_id, comment=comment.strip())
     db.session.add(new_reply)
     db.session.commit()
     flash('Reply added.', 'success')
-    return redirect(url_for('professor_detail', id=review.professor_id))
+    return redirect(url_for('main.professor_detail', id=review.professor_id))
 
 
-@app.route('/professor/dashboard')
+@main.route('/professor/dashboard')
 @login_required
 def professor_dashboard():
     # Only professors can access their dashboard
     if current_user.role != 'professor':
         flash('Only professors can access this dashboard.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     # Find the professor profile for this user
     professor = Professor.query.filter_by(user_id=current_user.id).first()
     if not professor:
         flash('No professor profile found for your account. Please add your profile.', 'warning')
-        return redirect(url_for('professor_signup'))
+        return redirect(url_for('main.professor_signup'))
 
     reviews = professor.reviews
     avg_rating = 0
@@ -506,39 +1112,85 @@ def professor_dashboard():
 
     ai_summary = generate_reviews_summary(reviews)
 
-    return render_template('professor_dashboard.html', professor=professor, reviews=reviews, avg_rating=round(avg_rating, 1), ai_summary=ai_summary)
+    trends = professor_trends(professor.id)
+    return render_template('professor_dashboard.html', professor=professor, reviews=reviews, avg_rating=round(avg_rating, 1), ai_summary=ai_summary, trends=trends)
+
+
+@main.route('/professor/dashboard/stream')
+@login_required
+def professor_dashboard_stream():
+    # Server-sent events with new reviews, replies and totals for the dashboard (see review_events.py)
+    if current_user.role != 'professor':
+        return jsonify({'status': 'error', 'message': 'Only professors have a dashboard stream'}), 403
+    professor = Professor.query.filter_by(user_id=current_user.id).first()
+    if not professor:
+        return jsonify({'status': 'error', 'message': 'No professor profile found'}), 404
+    return review_events.stream(f'professor:{professor.id}')
 
 
-@app.route('/admin/reviews')
+@main.route('/admin/reviews')
 @login_required
 def admin_reviews():
     # Only admins can access the admin review management page
     if getattr(current_user, 'role', None) != 'admin':
         flash('Admin access required.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
+
+    # Show all reviews, newest first, with related professor and user info. Users are
+    # global, so with shards they come from an IN query per chunk instead of a join.
+    user_loader = selectinload(Review.user) if shard_router.enabled else joinedload(Review.user)
+    streams = []
+    for shard in db.session().shard_names():
+        reviews = (Review.query.options(joinedload(Review.professor), user_loader)
+                   .order_by(Review.created_at.desc(), Review.id.desc())
+                   .execution_options(identity_token=shard))
+        # Every review is on the page, so read all replies in one pass, in the same order
+        replies = (ReviewReply.query.join(Review, Review.id == ReviewReply.review_id)
+                   .order_by(Review.created_at.desc(), Review.id.desc(), ReviewReply.created_at.asc())
+                   .execution_options(identity_token=shard))
+        streams.append(with_replies(reviews.yield_per(current_app.config['STREAM_CHUNK_SIZE']),
+                                    replies.yield_per(current_app.config['STREAM_CHUNK_SIZE'])))
+
+    def annotated(reviews):
+        # For display convenience, annotate author_name and professor_name
+        for r in reviews:
+            r.professor_name = r.professor.name if r.professor else 'Unknown'
+            r.author_name = r.user.username if (r.user and r.user.username) else 'Anonymous'
+            yield r
+
+    # Each shard is already sorted; interleave them by date
+    reviews = heapq.merge(*streams, key=lambda r: (r.created_at or datetime.min, r.id), reverse=True)
+    return stream_page('admin_reviews.html', reviews=annotated(reviews))
+
+
+@main.route('/admin/profiles/<name>')
+@login_required
+def admin_profile_report(name):
+    # Saved request profiles; ?format=folded gives collapsed stacks for flamegraph.pl / speedscope
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('Admin access required.', 'danger')
+        return redirect(url_for('main.home'))
 
-    # Show all reviews with related professor and user info
-    reviews = Review.query.order_by(Review.created_at.desc()).all()
-    # For display convenience, annotate author_name and professor_name
-    for r in reviews:
-        r.professor_name = r.professor.name if r.professor else 'Unknown'
-        r.author_name = r.user.username if (r.user and r.user.username) else 'Anonymous'
-        r.replies_list = ReviewReply.query.filter_by(review_id=r.id).order_by(ReviewReply.created_at.asc()).all()
-    return render_template('admin_reviews.html', reviews=reviews)
+    report = profiler.load(name)
+    if report is None:
+        return jsonify({'status': 'error', 'message': 'Profile not found'}), 404
+    if request.args.get('format') == 'folded':
+        return current_app.response_class(report['collapsed_stacks'] + '\n', mimetype='text/plain')
+    return jsonify(report)
 
 
-@app.route('/admin/review/<int:review_id>/delete', methods=['POST'])
+@main.route('/admin/review/<int:review_id>/delete', methods=['POST'])
 @login_required
 def admin_delete_review(review_id):
     # Only admins can delete reviews
     if getattr(current_user, 'role', None) != 'admin':
         flash('Admin access required.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     review = Review.query.get(review_id)
     if not review:
         flash('Review not found.', 'warning')
-        return redirect(url_for('admin_reviews'))
+        return redirect(url_for('main.admin_reviews'))
 
     try:
         # Delete associated replies first
@@ -563,23 +1215,23 @@ def admin_delete_review(review_id):
         
     except Exception as e:
         db.session.rollback()
-        app.logger.exception('Error deleting review')
+        current_app.logger.exception('Error deleting review')
         flash(f'Error deleting review: {str(e)}', 'danger')
     
-    return redirect(url_for('admin_reviews'))
+    return redirect(url_for('main.admin_reviews'))
 
 
-@app.route('/admin/reply/<int:reply_id>/delete', methods=['POST'])
+@main.route('/admin/reply/<int:reply_id>/delete', methods=['POST'])
 @login_required
 def admin_delete_reply(reply_id):
     if getattr(current_user, 'role', None) != 'admin':
         flash('Admin access required.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     
     reply = ReviewReply.query.get(reply_id)
     if not reply:
         flash('Reply not found.', 'warning')
-        return redirect(url_for('admin_reviews'))
+        return redirect(url_for('main.admin_reviews'))
     
     try:
         db.session.delete(reply)
@@ -587,10 +1239,10 @@ def admin_delete_reply(reply_id):
         flash('Reply deleted.', 'success')
     except Exception as e:
         db.session.rollback()
-        app.logger.exception('Error deleting reply')
+        current_app.logger.exception('Error deleting reply')
         flash(f'Error deleting reply: {str(e)}', 'danger')
     
-    return redirect(url_for('admin_reviews'))
+    return redirect(url_for('main.admin_reviews'))
 
 def generate_reviews_summary(reviews):
     # Simple heuristic summarizer: collect comments for negative/neutral reviews (rating <= 3)
@@ -615,14 +1267,28 @@ def generate_reviews_summary(reviews):
         return 'Criticisms noted but unable to extract common themes.'
     return 'Common criticisms: ' + ', '.join(common)
 
-@app.route('/professor/<int:id>/add_review', methods=['POST'])
+@main.route('/professor/<int:id>/add_review', methods=['POST'])
 def add_review(id):
     if current_user.is_authenticated and current_user.review_deletion_count >= 3:
         flash('Your account has been blocked from posting reviews due to multiple rule violations.', 'danger')
-        return redirect(url_for('professor_detail', id=id))
-    rating = int(request.form.get('rating'))
-    course = request.form.get('course')
+        return redirect(url_for('main.professor_detail', id=id))
+    # A resubmitted form (double click, retry, back button) gets the original result without writing again
+    key = submission_key()
+    done = submitted_review(Review, key)
+    if done:
+        return redirect(url_for('main.professor_detail', id=done.professor_id))
+
+    rating_val = request.form.get('rating')
+    course = (request.form.get('course') or '').strip()
     comment = request.form.get('comment')
+    if not course or not rating_val:
+        flash('Course and rating are required.', 'danger')
+        return redirect(url_for('main.professor_detail', id=id))
+    try:
+        rating = int(rating_val)
+    except ValueError:
+        flash('Invalid rating.', 'danger')
+        return redirect(url_for('main.professor_detail', id=id))
     # Allow anonymous reviews if user is not logged in
     user_id = current_user.id if current_user.is_authenticated else None
     # New fields: grade, semester, year
@@ -633,15 +1299,21 @@ def add_review(id):
         year = int(year_val) if year_val else None
     except ValueError:
         year = None
+
+    # Fast conflict path: the unique index would refuse the insert anyway, this skips the attempt
+    if existing_review(user_id, id, course, semester, year):
+        flash(already_reviewed_message(f'{course} with this professor', semester, year), 'warning')
+        return redirect(url_for('main.professor_detail', id=id))
     new_review = Review(user_id=user_id, professor_id=id, course_code=course, rating=rating, comment=comment)
     new_review.grade = grade
     new_review.semester = semester
     new_review.year = year
-    db.session.add(new_review)
-    db.session.commit()
-    return redirect(url_for('professor_detail', id=id))
+    review, conflict = save_review(new_review, key, lambda: existing_review(user_id, id, course, semester, year))
+    if conflict:
+        flash(already_reviewed_message(f'{course} with this professor', semester, year), 'warning')
+    return redirect(url_for('main.professor_detail', id=review.professor_id))
 
-@app.route('/professor/add', methods=['GET', 'POST'])
+@main.route('/professor/add', methods=['GET', 'POST'])
 def add_professor():
     if request.method == 'POST':
         name = request.form.get('name')
@@ -654,24 +1326,31 @@ def add_professor():
         # Basic validation
         if not name:
             flash('Professor name is required.', 'danger')
-            return redirect(url_for('add_professor'))
+            return redirect(url_for('main.add_professor'))
 
         # Avoid duplicate professor with same name & university
         exists = Professor.query.filter_by(name=name, university=university).first()
         if exists:
             flash('This professor already exists.', 'warning')
-            return redirect(url_for('professor_detail', id=exists.id))
+            return redirect(url_for('main.professor_detail', id=exists.id))
+
+        # Near-duplicates ("Dr. Alan Turing" vs "Alan Turing") need an explicit confirmation
+        if not request.form.get('confirm_new'):
+            suggestions = [p for p, score in professor_matcher.suggest(name, university)]
+            if suggestions:
+                flash('Similar professors already exist. Is one of them who you meant?', 'warning')
+                return render_template('add_professor.html', suggestions=suggestions, form=request.form)
 
         new_prof = Professor(name=name, department=department, university=university)
         db.session.add(new_prof)
         db.session.commit()
         flash('Professor added successfully!', 'success')
-        return redirect(url_for('professor_detail', id=new_prof.id))
+        return redirect(url_for('main.professor_detail', id=new_prof.id))
 
-    return render_template('add_professor.html')
+    return render_template('add_professor.html', suggestions=[], form={})
 
 
-@app.route('/professor/signup', methods=['GET', 'POST'])
+@main.route('/professor/signup', methods=['GET', 'POST'])
 def professor_signup():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -686,15 +1365,22 @@ def professor_signup():
 
         if not username or not password or not prof_name:
             flash('Username, password, and professor name are required for professor signup.', 'danger')
-            return redirect(url_for('professor_signup'))
+            return redirect(url_for('main.professor_signup'))
 
         if User.query.filter_by(username=username).first():
             flash('Username already exists. Please choose another.', 'danger')
-            return redirect(url_for('professor_signup'))
+            return redirect(url_for('main.professor_signup'))
+
+        existing = professor_matcher.find_duplicate(prof_name, university)
+        if existing and not request.form.get('confirm_new'):
+            flash(f'A profile for {existing.name} ({existing.university or "unknown university"}) already exists. '
+                  'If that is not you, tick "This is a different professor", re-enter your password and sign up again.', 'warning')
+            return render_template('professor_signup.html', suggestions=professor_suggestions(existing, prof_name, university),
+                                   form=request.form)
 
         if email and User.query.filter_by(email=email).first():
             flash('Email already registered. Please login instead.', 'danger')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
 
         hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
         user = User(username=username, email=email or None, password_hash=hashed_pw, role='professor')
@@ -709,80 +1395,75 @@ def professor_signup():
         # Log in the user
         login_user(user)
         flash('Professor account created and profile registered.', 'success')
-        return redirect(url_for('professor_dashboard'))
-    return render_template('professor_signup.html')
+        return redirect(url_for('main.professor_dashboard'))
+    return render_template('professor_signup.html', suggestions=[], form={})
 
-@app.route('/course/<string:course_code>')
+@main.route('/course/<string:course_code>')
 def course_detail(course_code):
     course = Course.query.filter_by(code=course_code).first_or_404()
-    
-    # Get all course reviews
-    reviews = course.reviews
-    
-    # Calculate average rating
-    avg_rating = 0
-    if reviews:
-        avg_rating = sum([r.rating for r in reviews]) / len(reviews)
-    
-    # Get professor reviews for this course
-    professor_reviews = Review.query.filter_by(course_code=course_code).all()
-    
-    # Calculate average professor rating for this course
-    prof_avg_rating = 0
-    if professor_reviews:
-        prof_avg_rating = sum([r.rating for r in professor_reviews]) / len(professor_reviews)
-    
+
+    # Ratings, counts and per-professor averages come from the rollups, not from loading every review
+    course_rows, professor_rows = course_rollups(course)
+    review_count, avg_rating = rating_summary(course_rows)
+    _prof_review_count, prof_avg_rating = rating_summary(professor_rows)
+
+    totals = {}
+    for row in professor_rows:
+        count, rating_sum = totals.get(row.professor_id, (0, 0))
+        totals[row.professor_id] = (count + row.review_count, rating_sum + row.rating_sum)
     # Get all professors who taught this course
-    professors = {}
-    for review in professor_reviews:
-        if review.professor:
-            prof_id = review.professor.id
-            if prof_id not in professors:
-                professors[prof_id] = {
-                    'professor': review.professor,
-                    'review_count': 0,
-                    'avg_rating': 0
-                }
-            professors[prof_id]['review_count'] += 1
-    
-    # Calculate average rating per professor for this course
-    for prof_id, data in professors.items():
-        prof_reviews = [r for r in professor_reviews if r.professor_id == prof_id]
-        if prof_reviews:
-            data['avg_rating'] = sum([r.rating for r in prof_reviews]) / len(prof_reviews)
-    
-    return render_template('course_detail.html',
-                         course=course,
-                         reviews=reviews,
-                         avg_rating=round(avg_rating, 1),
-                         professors=list(professors.values()),
-                         prof_avg_rating=round(prof_avg_rating, 1))
-
-@app.route('/review/course', methods=['GET', 'POST'])
+    professors = []
+    if totals:
+        for prof in Professor.query.filter(Professor.id.in_(list(totals))).order_by(Professor.id):
+            count, rating_sum = totals[prof.id]
+            if count > 0:
+                professors.append({'professor': prof, 'review_count': count, 'avg_rating': rating_sum / count})
+
+    # Course reviews are read while the page streams
+    reviews = (review for chunk in iter_chunks(CourseReview.query.filter_by(course_id=course.id).order_by(CourseReview.id))
+               for review in chunk)
+    return stream_page('course_detail.html',
+                       course=course,
+                       reviews=reviews,
+                       review_count=review_count,
+                       avg_rating=avg_rating,
+                       professors=professors,
+                       prof_avg_rating=prof_avg_rating,
+                       trends={'course_reviews': trend_rows(course_rows), 'professor_reviews': trend_rows(professor_rows)})
+
+@main.route('/review/course', methods=['GET', 'POST'])
 @login_required
 def review_course():
     if request.method == 'POST':
         # Check if user is blocked
         if current_user.review_deletion_count >= 3:
             flash('Your account has been blocked from posting reviews due to multiple rule violations.', 'danger')
-            return redirect(url_for('review_course'))
-        
+            return redirect(url_for('main.review_course'))
+
+        # A resubmitted form gets the original result without writing again
+        key = submission_key()
+        done = submitted_review(CourseReview, key)
+        if done:
+            flash('Course review submitted!', 'success')
+            return redirect(url_for('main.course_detail', course_code=done.course.code))
+
         course_code = request.form.get('course', '').strip()
         rating = request.form.get('rating')
         comment = request.form.get('comment', '').strip() or None
         grade = request.form.get('grade', '').strip() or None
         semester = request.form.get('semester', '').strip() or None
         year = request.form.get('year', '').strip()
+        year = int(year) if year and year.isdigit() else None
         
         if not course_code or not rating:
             flash('Course and rating are required.', 'danger')
-            return redirect(url_for('review_course'))
+            return redirect(url_for('main.review_course'))
         
         try:
             rating_int = int(rating)
         except ValueError:
             flash('Invalid rating.', 'danger')
-            return redirect(url_for('review_course'))
+            return redirect(url_for('main.review_course'))
         
         # Find or create course
         course = Course.query.filter_by(code=course_code).first()
@@ -790,7 +1471,12 @@ def review_course():
             course = Course(code=course_code)
             db.session.add(course)
             db.session.commit()
-        
+
+        # Fast conflict path: the unique index would refuse the insert anyway, this skips the attempt
+        if existing_course_review(current_user.id, course.id, semester, year):
+            flash(already_reviewed_message(course_code, semester, year), 'warning')
+            return redirect(url_for('main.course_detail', course_code=course_code))
+
         # Create course review
         review = CourseReview(
             user_id=current_user.id,
@@ -799,24 +1485,25 @@ def review_course():
             comment=comment,
             grade=grade,
             semester=semester,
-            year=int(year) if year and year.isdigit() else None
+            year=year
         )
-        
-        db.session.add(review)
-        db.session.commit()
-        
-        flash('Course review submitted!', 'success')
-        return redirect(url_for('course_detail', course_code=course_code))
+        review, conflict = save_review(review, key,
+                                       lambda: existing_course_review(current_user.id, course.id, semester, year))
+        if conflict:
+            flash(already_reviewed_message(course_code, semester, year), 'warning')
+        else:
+            flash('Course review submitted!', 'success')
+        return redirect(url_for('main.course_detail', course_code=course_code))
     
     # GET request - show form
     course_code = request.args.get('course', '')
     return render_template('review_course.html', course_code=course_code)
 
-@app.route('/course/search')
+@main.route('/course/search')
 def course_search():
     q = request.args.get('q', '').strip()
     if not q:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     
     # Search courses by code or title
     courses = Course.query.filter(
@@ -840,25 +1527,16 @@ def course_search():
                          courses=[], 
                          course_results=courses)
 
-@app.route('/vote/<int:review_id>/<vote_type>', methods=['POST'])
+@main.route('/vote/<int:review_id>/<vote_type>', methods=['POST'])
 def vote_review(review_id, vote_type):
     # Ensure the user is authenticated; return JSON 401 if not (AJAX-friendly)
     if not current_user.is_authenticated:
         return jsonify({'status': 'error', 'message': 'Login required'}), 401
-    # Parse vote_type flexibly: accept '1', '-1', 'like', 'dislike'
-    try:
-        vt = int(vote_type)
-    except ValueError:
-        vt_lower = vote_type.lower()
-        if vt_lower in ('like', 'up'):
-            vt = 1
-        elif vt_lower in ('dislike', 'down'):
-            vt = -1
-        else:
-            return jsonify({'status': 'error', 'message': 'Invalid vote type'}), 400
+    vote_type = parse_vote_type(vote_type)
+    if vote_type is None:
+        return jsonify({'status': 'error', 'message': 'Invalid vote type'}), 400
 
     # Check if user already voted
-    vote_type = vt
     existing_vote = ReviewVote.query.filter_by(user_id=current_user.id, review_id=review_id).first()
     
     if existing_vote:
@@ -876,17 +1554,288 @@ def vote_review(review_id, vote_type):
     db.session.commit()
 
     # Recompute counts and return them to the client
-    likes_count = ReviewVote.query.filter_by(review_id=review_id, vote_type=1).count()
-    dislikes_count = ReviewVote.query.filter_by(review_id=review_id, vote_type=-1).count()
+    counts = db.session.execute(vote_counts_where(review_id)).all()
+    likes_count = sum(n for vt, n in counts if vt == 1)
+    dislikes_count = sum(n for vt, n in counts if vt == -1)
     # Determine current user's vote after the change
     user_vote_obj = ReviewVote.query.filter_by(review_id=review_id, user_id=current_user.id).first()
     user_vote = user_vote_obj.vote_type if user_vote_obj else 0
 
     return jsonify({'status': 'success', 'likes': likes_count, 'dislikes': dislikes_count, 'user_vote': user_vote})
 
+def load_config(app, config=None):
+    # Read configuration when the app is built, not when this module is imported
+    app.config.from_mapping(
+        SQLALCHEMY_DATABASE_URI=os.environ.get(
+            'DATABASE_URL',
+            'sqlite:///site.db'  # fallback for local dev
+        ),
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'key'),  # Needed for session management
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Optional read replicas for GET traffic, e.g. "sqlite:///replica1.db,sqlite:///replica2.db"
+        DATABASE_REPLICA_URLS=os.environ.get('DATABASE_REPLICA_URLS', ''),
+        # How long (seconds) a user's reads stay on the primary after they submit something
+        REPLICA_STICKY_SECONDS=int(os.environ.get('REPLICA_STICKY_SECONDS', 5)),
+        # Optional per-university shards, e.g. "east=sqlite:///east.db,west=sqlite:///west.db"
+        DATABASE_SHARDS=os.environ.get('DATABASE_SHARDS', ''),
+        # How long (seconds) workers cache the university -> shard map
+        SHARD_MAP_TTL=int(os.environ.get('SHARD_MAP_TTL', 30)),
+        # Stream the long review pages (professor, course, admin) instead of rendering them whole
+        STREAM_PAGES=os.environ.get('STREAM_PAGES', '1') != '0',
+        STREAM_CHUNK_SIZE=500,  # reviews fetched from the database at a time
+        STREAM_BUFFER_SIZE=8192,  # characters of HTML sent at a time
+        # Carries live dashboard events between workers: "memory://" (one process) or "redis://..."
+        REVIEW_EVENTS_URL=os.environ.get('REVIEW_EVENTS_URL', 'memory://'),
+    )
+    if config:
+        app.config.from_mapping(config)
+
+
+def create_app(config=None):
+    """Build the Flask app. Does not touch the database schema; use `flask init-db` for that."""
+    timings = {'import_ms': IMPORT_MS}
+    started = time.perf_counter()
+    app = Flask(__name__)
+    load_config(app, config)
+    timings['config_ms'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+    replica_router.init_app(app)
+    shard_router.init_app(app)
+    assets.init_app(app)
+    catalog.init_app(app, shard_engines=shard_router.all_engines)
+    review_events.init_app(app)
+    profiler.init_app(app, engines=lambda: (list(db.engines.values()) + replica_router.replicas
+                                            + list(shard_router.engines.values())))
+    timings['extensions_ms'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    app.register_blueprint(main)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(dedupe_reviews_command)
+    app.cli.add_command(startup_report_command)
+    app.cli.add_command(find_duplicate_professors_command)
+    app.cli.add_command(merge_professors_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(recompute_similar_professors_command)
+    app.cli.add_command(move_university_command)
+    app.cli.add_command(shard_status_command)
+    timings['routes_ms'] = (time.perf_counter() - started) * 1000
+    app.extensions['startup_timings'] = timings
+    app.logger.info('Startup timings: %s', format_timings(timings))
+
+    @app.before_request
+    def _mark_first_request():
+        if 'first_request_ms' not in timings:
+            g.first_request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_first_request(response):
+        # Time the first request separately: it pays for the lazy engine/pool and template setup
+        if 'first_request_ms' not in timings and 'first_request_started' in g:
+            timings['first_request_ms'] = (time.perf_counter() - g.first_request_started) * 1000
+            app.logger.info('First request warmup: %.1f ms', timings['first_request_ms'])
+        return response
+
+    return app
+
+
+def format_timings(timings):
+    return ', '.join(f"{k}={v:.1f}" for k, v in timings.items())
+
+
+def init_db():
+    """Create or update the schema on the primary and every shard.
+
+    Returns the added columns as "table.column" strings. Rollup tables created
+    here are filled from the existing reviews. Raises IntegrityError while
+    duplicate reviews block the unique review indexes.
+    """
+    # Rollups are only kept current from reviews written after they exist; new ones need filling
+    rollup_tables = [(db.engine, CourseRatingRollup.__tablename__)]
+    rollup_tables += [(shard_router.engine(name), ProfessorRatingRollup.__tablename__) for name in shard_router.names]
+    backfill = any(not inspect(engine).has_table(table) for engine, table in rollup_tables)
+    added = sync_schema(db.engine, db.metadata)
+    for shard_added in shard_router.create_all().values():
+        added += shard_added
+    if backfill:
+        rebuild_rating_rollups()
+    return sorted(set(added))
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create any missing database tables, nullable columns and indexes."""
+    try:
+        added = init_db()
+    except IntegrityError as e:
+        # The unique review indexes can't be built while older duplicate reviews exist
+        raise click.ClickException(f'{e.orig}. Run `flask dedupe-reviews`, then init-db again.')
+    for column in added:
+        click.echo(f'Added column {column}.')
+    click.echo('Database tables created.')
+
+
+@click.command('dedupe-reviews')
+@with_appcontext
+def dedupe_reviews_command():
+    """Delete repeat reviews of the same course and term by one user, keeping the oldest."""
+    removed = remove_duplicate_reviews(review_duplicates())
+    course_duplicates = course_review_duplicates()
+    for chunk in chunks(course_duplicates):
+        CourseReview.query.filter(CourseReview.id.in_(chunk)).delete(synchronize_session=False)
+    db.session.commit()
+    if removed or course_duplicates:
+        rebuild_rating_rollups()
+    click.echo(f'Removed {removed} duplicate review(s) and {len(course_duplicates)} duplicate course review(s).')
+
+
+@click.command('rebuild-rollups')
+@with_appcontext
+def rebuild_rollups_command():
+    """Recompute the per-term rating rollups from all reviews."""
+    rebuild_rating_rollups()
+    click.echo('Rating rollups rebuilt.')
+
+
+@click.command('recompute-similar-professors')
+@click.option('--top', default=None, type=int, help='Neighbours to keep per professor (default 5).')
+@with_appcontext
+def recompute_similar_professors_command(top):
+    """Recompute the "similar professors" recommendations (needs NumPy)."""
+    started = time.perf_counter()
+    pairs = recompute_similar_professors(top)
+    click.echo(f"Stored {pairs} similar-professor pair(s) in {time.perf_counter() - started:.1f}s.")
+
+
+@click.command('move-university')
+@click.argument('university')
+@click.argument('shard')
+@click.option('--wait', default=None, type=float, help='Seconds to wait for workers to see the map change (default SHARD_MAP_TTL).')
+@with_appcontext
+def move_university_command(university, shard, wait):
+    """Move a university's professors, reviews, votes and replies to SHARD."""
+    started = time.perf_counter()
+    moved = shard_router.move_university(university, shard, wait=wait, log=click.echo)
+    if not moved:
+        click.echo(f"{university} is already on {shard}.")
+        return
+    catalog.rebuild()
+    click.echo(f"Moved {university} to {shard} in {time.perf_counter() - started:.1f}s: "
+               + ', '.join(f"{n} {table}" for table, n in moved.items()))
+
+
+@click.command('shard-status')
+@with_appcontext
+def shard_status_command():
+    """Print every shard with its professor/review counts and the mapped universities."""
+    mapped = shard_router.university_map()
+    for shard in shard_router.names:
+        with shard_router.engine(shard).connect() as conn:
+            professors = conn.execute(select(func.count(Professor.id))).scalar()
+            reviews = conn.execute(select(func.count(Review.id))).scalar()
+        universities = sorted(f"{key}{' (moving)' if moving else ''}"
+                              for key, (name, moving) in mapped.items() if name == shard)
+        click.echo(f"{shard:>12}: {professors} professor(s), {reviews} review(s)"
+                   + (f"; {', '.join(universities)}" if universities else ''))
+
+
+@click.command('find-duplicate-professors')
+@click.option('--threshold', default=0.8, help='Minimum name similarity (0-1).')
+@with_appcontext
+def find_duplicate_professors_command(threshold):
+    """Print likely duplicate professors as "keep_id duplicate_id score" lines."""
+    for keep_id, dup_id, score in professor_matcher.duplicate_pairs(threshold):
+        click.echo(f"{keep_id} {dup_id} {score}")
+
+
+@click.command('merge-professors')
+@click.argument('keep_id', type=int, required=False)
+@click.argument('duplicate_ids', type=int, nargs=-1)
+@click.option('--pairs', type=click.File(), help='File of "keep_id duplicate_id ..." lines, e.g. from find-duplicate-professors.')
+@with_appcontext
+def merge_professors_command(keep_id, duplicate_ids, pairs):
+    """Move reviews from duplicate professors onto KEEP_ID and delete the duplicates."""
+    merges = {}
+    if keep_id is not None:
+        merges[keep_id] = set(duplicate_ids)
+    if pairs:
+        for line in pairs:
+            parts = line.split()
+            if len(parts) >= 2:
+                merges.setdefault(int(parts[0]), set()).add(int(parts[1]))
+    # Follow chains (c -> b -> a) so everything lands on a professor that survives
+    merged_into = {dup: keep for keep, dups in merges.items() for dup in dups}
+    targets = {}
+    for dup in merged_into:
+        keep, seen = dup, set()
+        while keep in merged_into and keep not in seen:
+            seen.add(keep)
+            keep = merged_into[keep]
+        if keep != dup:
+            targets.setdefault(keep, set()).add(dup)
+    for keep, dups in targets.items():
+        try:
+            moved = merge_professors(keep, dups)
+        except ShardingError as e:
+            click.echo(f"Skipped {sorted(dups)}: {e}")
+            continue
+        click.echo(f"Merged {sorted(dups)} into {keep}: {moved} review(s) moved.")
+
+
+def merge_professors(keep_id, duplicate_ids):
+    """Re-point reviews of duplicate_ids at keep_id in one UPDATE, then delete the duplicates."""
+    duplicate_ids = [pid for pid in duplicate_ids if pid != keep_id]
+    keep = db.session.get(Professor, keep_id)
+    if keep is None or not duplicate_ids:
+        return 0
+    elsewhere = [p.id for p in Professor.query.filter(Professor.id.in_(duplicate_ids)) if shard_of(p) != shard_of(keep)]
+    if elsewhere:
+        raise ShardingError(f'Professors {elsewhere} are on a different shard than {keep_id}; '
+                            'move their university first (flask move-university)')
+    # A user who reviewed the same course and term under two of these profiles would
+    # break the one-review-per-term index once they're merged; keep their oldest review
+    dropped = remove_duplicate_reviews(review_duplicates([keep_id] + duplicate_ids, into=keep_id))
+    if dropped:
+        current_app.logger.info('Dropped %d duplicate review(s) merging %s into %s', dropped, duplicate_ids, keep_id)
+    moved = (Review.query.filter(Review.professor_id.in_(duplicate_ids))
+             .update({Review.professor_id: keep_id}, synchronize_session=False))
+    # Keep a linked professor account if the surviving profile doesn't have one
+    if keep.user_id is None:
+        linked = (Professor.query.filter(Professor.id.in_(duplicate_ids), Professor.user_id.isnot(None))
+                  .order_by(Professor.id).first())
+        if linked:
+            keep.user_id = linked.user_id
+    ProfessorRatingRollup.query.filter(ProfessorRatingRollup.professor_id.in_(duplicate_ids)).delete(synchronize_session=False)
+    ProfessorSimilarity.query.filter(or_(ProfessorSimilarity.professor_id.in_(duplicate_ids),
+                                         ProfessorSimilarity.similar_id.in_(duplicate_ids))).delete(synchronize_session=False)
+    Professor.query.filter(Professor.id.in_(duplicate_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    rebuild_rating_rollups([keep_id])
+    for pid in duplicate_ids:
+        professor_matcher.remove(pid)
+    # The bulk delete above bypasses the session events that normally refresh these
+    catalog.rebuild()
+    return moved
+
+
+@click.command('startup-report')
+@click.option('--path', default='/', help='URL to use for the warmup request.')
+@with_appcontext
+def startup_report_command(path):
+    """Print app startup timings including a warmup request."""
+    app = current_app._get_current_object()
+    app.test_client().get(path)
+    for name, ms in app.extensions['startup_timings'].items():
+        click.echo(f"{name.removesuffix('_ms'):>14}: {ms:8.1f} ms")
+
+
+IMPORT_MS = (time.perf_counter() - _import_started) * 1000
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
-
-with app.app_context():
-    db.create_all()
+    create_app().run(host='0.0.0.0', port=port)
@@ -0,0 +1,142 @@
+"""ASGI entry point.
+
+The small JSON endpoints (course/professor typeahead and voting) are served here
+with an async SQLAlchemy engine (or the catalog snapshot) so a slow database round trip doesn't tie up a
+whole worker. Everything else is passed through to the normal Flask app, as are
+the database-backed endpoints when DATABASE_SHARDS is set.
+
+Run with:
+    uvicorn asgi:application
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+"""
+import time
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from app import (create_app, catalog, course_code_conditions, db, parse_vote_type, professors_with_reviews_where,
+                 shard_router, vote_counts_where, ReviewVote)
+from db_routing import STICKY_SESSION_KEY
+
+
+# Map the sync drivers used by the Flask app to their asyncio counterparts
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+
+def make_async_engine():
+    # Reuse the Flask app's resolved URL so both paths hit the same database
+    with flask_app.app_context():
+        url = db.engine.url
+    url = url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+    return create_async_engine(url, pool_pre_ping=True)
+
+
+flask_app = create_app()
+engine = make_async_engine()
+Session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def current_user_id(request):
+    # Read the Flask-Login user id out of Flask's signed session cookie
+    cookie = request.cookies.get(flask_app.config.get('SESSION_COOKIE_NAME', 'session'))
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(cookie)
+    except Exception:
+        return None
+    user_id = data.get('_user_id')
+    return int(user_id) if user_id else None
+
+
+def remember_write(request, response):
+    """Record a write in the Flask session like ReplicaRouter does after Flask requests.
+
+    Without it the user's next page could come from a replica that hasn't seen the write yet.
+    """
+    if not flask_app.extensions['replica_router'].replicas:
+        return
+    # Let Flask's own session interface read and re-sign the cookie so its settings all apply
+    interface = flask_app.session_interface
+    with flask_app.test_request_context(headers={'Cookie': request.headers.get('cookie', '')}) as ctx:
+        session = interface.open_session(flask_app, ctx.request)
+        session[STICKY_SESSION_KEY] = time.time()
+        cookies = flask_app.response_class()
+        interface.save_session(flask_app, session, cookies)
+    for value in cookies.headers.getlist('Set-Cookie'):
+        response.headers.append('set-cookie', value)
+
+
+async def professors_for_course(request):
+    q_stripped = (request.query_params.get('q') or '').strip()
+    if not q_stripped:
+        return JSONResponse([])
+
+    rows = []
+    async with Session() as session:
+        for condition in course_code_conditions(q_stripped):
+            rows = (await session.execute(professors_with_reviews_where(condition))).all()
+            if rows:
+                break
+    return JSONResponse([{'id': pid, 'name': name} for pid, name in rows])
+
+
+async def course_codes(request):
+    # Served straight from the shared catalog snapshot; no database round trip at all
+    with flask_app.app_context():
+        body = catalog.course_codes_json()
+    return Response(body, media_type='application/json')
+
+
+async def vote_review(request):
+    user_id = current_user_id(request)
+    if not user_id:
+        return JSONResponse({'status': 'error', 'message': 'Login required'}, status_code=401)
+
+    review_id = request.path_params['review_id']
+    vt = parse_vote_type(request.path_params['vote_type'])
+    if vt is None:
+        return JSONResponse({'status': 'error', 'message': 'Invalid vote type'}, status_code=400)
+
+    async with Session() as session:
+        existing_vote = (await session.execute(
+            select(ReviewVote).filter_by(user_id=user_id, review_id=review_id)
+        )).scalars().first()
+        if existing_vote:
+            if existing_vote.vote_type == vt:
+                # Toggle off if clicking same button (remove vote)
+                await session.delete(existing_vote)
+                user_vote = 0
+            else:
+                existing_vote.vote_type = vt
+                user_vote = vt
+        else:
+            session.add(ReviewVote(user_id=user_id, review_id=review_id, vote_type=vt))
+            user_vote = vt
+        await session.commit()
+
+        counts = dict((await session.execute(vote_counts_where(review_id))).all())
+
+    response = JSONResponse({'status': 'success', 'likes': counts.get(1, 0), 'dislikes': counts.get(-1, 0), 'user_vote': user_vote})
+    remember_write(request, response)
+    return response
+
+
+routes = [Route('/api/course_codes', course_codes)]
+if not shard_router.enabled:
+    # The async engine only reaches the primary; with shards configured the Flask
+    # routes (which know how to route per university) serve these instead
+    routes += [
+        Route('/api/professors_for_course', professors_for_course),
+        Route('/vote/{review_id:int}/{vote_type}', vote_review, methods=['POST']),
+    ]
+application = Starlette(routes=routes + [Mount('/', app=WSGIMiddleware(flask_app))])
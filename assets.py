@@ -0,0 +1,161 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import zlib
+
+import click
+from flask import current_app, request, send_file
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+ONE_YEAR = 60 * 60 * 24 * 365
+COMPRESSIBLE_TYPES = ('text/html', 'application/json', 'text/css', 'application/javascript', 'text/javascript')
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+class Assets:
+    """Static file fingerprinting, response compression and the Jinja bytecode cache.
+
+    - url_for('static', filename=...) gets a ?v=<content hash> argument, and static
+      files requested with a matching hash are served with a one year immutable
+      Cache-Control.
+    - `flask compress-static` writes .gz/.br files next to each static file; those
+      are sent instead of the original when the browser accepts them.
+    - HTML/JSON responses larger than COMPRESS_MIN_SIZE are compressed on the fly.
+    """
+
+    def __init__(self, app=None):
+        self._hashes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+        app.extensions['assets'] = self
+        self._hashes = {}
+
+        cache_dir = app.config['JINJA_BYTECODE_CACHE_DIR']
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(cache_dir)}
+
+        app.url_defaults(self._add_static_hash)
+        app.before_request(self._serve_precompressed)
+        app.after_request(self._cache_and_compress)
+        app.cli.add_command(compress_static_command)
+
+    def file_hash(self, filename):
+        # Recompute in debug so edits show up without a restart
+        if filename not in self._hashes or current_app.debug:
+            path = safe_join(current_app.static_folder, filename)
+            if not path or not os.path.isfile(path):
+                return None
+            with open(path, 'rb') as f:
+                self._hashes[filename] = hashlib.sha256(f.read()).hexdigest()[:12]
+        return self._hashes[filename]
+
+    def _add_static_hash(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            file_hash = self.file_hash(values['filename'])
+            if file_hash:
+                values['v'] = file_hash
+
+    def _serve_precompressed(self):
+        if request.endpoint != 'static':
+            return None
+        filename = request.view_args.get('filename')
+        path = safe_join(current_app.static_folder, filename) if filename else None
+        if not path or not os.path.isfile(path):
+            return None
+        for encoding, ext in PRECOMPRESSED:
+            # Skip variants older than the source file (run compress-static again)
+            if (encoding in request.accept_encodings and os.path.isfile(path + ext)
+                    and os.path.getmtime(path + ext) >= os.path.getmtime(path)):
+                mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+                response = send_file(path + ext, mimetype=mimetype, conditional=True)
+                response.headers['Content-Encoding'] = encoding
+                response.vary.add('Accept-Encoding')
+                return response
+        return None
+
+    def _cache_and_compress(self, response):
+        if request.endpoint == 'static':
+            filename = (request.view_args or {}).get('filename')
+            if filename and request.args.get('v') == self.file_hash(filename):
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = ONE_YEAR
+                response.cache_control.immutable = True
+            return response
+
+        if (response.status_code != 200 or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+        if response.is_streamed:
+            # Streamed pages (text/event-stream is never compressible) are gzipped piece by piece
+            if 'gzip' in request.accept_encodings:
+                response.response = gzip_stream(response.response, current_app.config['COMPRESS_LEVEL'])
+                response.headers['Content-Encoding'] = 'gzip'
+                response.headers.pop('Content-Length', None)
+                response.vary.add('Accept-Encoding')
+            return response
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        level = current_app.config['COMPRESS_LEVEL']
+        if brotli is not None and 'br' in request.accept_encodings:
+            response.set_data(brotli.compress(data, quality=min(level, 11)))
+            response.headers['Content-Encoding'] = 'br'
+        elif 'gzip' in request.accept_encodings:
+            response.set_data(gzip.compress(data, compresslevel=level))
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+
+def gzip_stream(chunks, level):
+    """Gzip an iterable of str/bytes, flushing after every piece so the browser can render it."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip container
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+@click.command('compress-static')
+@with_appcontext
+def compress_static_command():
+    """Write .gz (and .br when brotli is installed) copies of static files."""
+    count = 0
+    for root, _dirs, files in os.walk(current_app.static_folder):
+        for name in files:
+            if name.endswith(('.gz', '.br')) or mimetypes.guess_type(name)[0] not in COMPRESSIBLE_TYPES:
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9))
+            if brotli is not None:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+            count += 1
+    click.echo(f'Compressed {count} static file(s).')
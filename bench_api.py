@@ -0,0 +1,114 @@
+"""Quick load test for the JSON API endpoints.
+
+Start the server one way or the other, then point this script at it:
+
+    gunicorn -w 2 wsgi:app                                  # sync workers
+    gunicorn -w 2 -k uvicorn.workers.UvicornWorker asgi:application
+
+    python bench_api.py http://127.0.0.1:8000 --concurrency 50 --requests 2000 --pid <gunicorn master pid>
+
+The default `lookup` scenario GETs the typeahead endpoints; `--scenario vote`
+logs in as --user and POSTs likes across the first --reviews review ids, so every
+request is a write. Serve bench_latency.py instead of wsgi/asgi to add a delay to
+each database statement.
+
+It prints throughput and latency percentiles, plus the total RSS of the server
+processes when --pid is given (Linux only), so the two setups can be compared at
+the same worker count / memory.
+"""
+import argparse
+import http.cookiejar
+import os
+import statistics
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+PATHS = [
+    '/api/course_codes',
+    '/api/professors_for_course?q=CS%20101',
+    '/api/professors_for_course?q=math',
+]
+
+
+def login(base_url, username, password):
+    """The session cookie header for a logged-in user."""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    form = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+    with opener.open(base_url + '/login', form, timeout=30) as resp:
+        # A successful login redirects away; a failed one re-renders the form
+        if urllib.parse.urlparse(resp.geturl()).path == '/login':
+            raise SystemExit(f'login as {username} failed')
+    return '; '.join(f'{c.name}={c.value}' for c in jar)
+
+
+def fetch(request):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as resp:
+            resp.read()
+            ok = resp.status == 200
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def rss_kb(pid):
+    # Sum resident memory of a process and its direct children
+    total = 0
+    pids = [pid]
+    children = f'/proc/{pid}/task/{pid}/children'
+    if os.path.exists(children):
+        with open(children) as f:
+            pids += [int(p) for p in f.read().split()]
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base_url')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--pid', type=int, default=None, help='server master pid, to report memory')
+    parser.add_argument('--scenario', choices=('lookup', 'vote'), default='lookup')
+    parser.add_argument('--user', default='test_student', help='account to vote as (vote scenario)')
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--reviews', type=int, default=5, help='vote on review ids 1..N (vote scenario)')
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip('/')
+    if args.scenario == 'vote':
+        cookie = login(base_url, args.user, args.password)
+        requests = [urllib.request.Request(f'{base_url}/vote/{i % args.reviews + 1}/like', data=b'',
+                                           headers={'Cookie': cookie}, method='POST')
+                    for i in range(args.requests)]
+    else:
+        requests = [base_url + PATHS[i % len(PATHS)] for i in range(args.requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(fetch, requests))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    errors = sum(1 for r in results if not r[1])
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {errors} errors")
+    print(f"throughput: {args.requests / elapsed:.1f} req/s")
+    print(f"latency ms: p50={statistics.median(latencies):.1f} "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1]:.1f} max={latencies[-1]:.1f}")
+    if args.pid:
+        print(f"server RSS: {rss_kb(args.pid) / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
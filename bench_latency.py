@@ -0,0 +1,40 @@
+"""Serve the app with a fixed delay added to every SQLite statement.
+
+Stands in for a database on another host when running bench_api.py locally:
+
+    gunicorn -w 2 bench_latency:app
+    gunicorn -w 2 -k uvicorn.workers.UvicornWorker bench_latency:application
+
+BENCH_DB_LATENCY_MS sets the delay per statement (default 20). The sleep runs in
+the sqlite3 trace callback, so it blocks the calling thread like a network round
+trip would: a sync worker waits it out, while aiosqlite runs it on its own thread
+and the event loop keeps serving other requests.
+"""
+import os
+import sqlite3
+import time
+
+LATENCY = float(os.environ.get('BENCH_DB_LATENCY_MS', '20')) / 1000
+
+_connect = sqlite3.connect
+
+
+def connect(*args, **kwargs):
+    conn = _connect(*args, **kwargs)
+    conn.set_trace_callback(lambda statement: time.sleep(LATENCY))
+    return conn
+
+
+# SQLAlchemy's pysqlite dialect connects through sqlite3.dbapi2, and aiosqlite through sqlite3
+sqlite3.connect = sqlite3.dbapi2.connect = connect
+
+
+def __getattr__(name):
+    # Import only the entry point that was asked for, after the patch above
+    if name == 'app':
+        from wsgi import app
+        return app
+    if name == 'application':
+        from asgi import application
+        return application
+    raise AttributeError(name)
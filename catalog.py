@@ -0,0 +1,199 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import select
+
+
+# File layout (little endian):
+#   header:   magic(8) version(Q) then (offset, length) Q pairs for each section
+#   sections: api course codes as a JSON array, review course codes as a JSON array,
+#             professors as count(I) + (count + 1) u32 record offsets + records,
+#             each record being "id\x1fname\x1fdepartment\x1funiversity" in UTF-8.
+MAGIC = b'RMPCAT01'
+SECTIONS = ('api_course_codes', 'review_course_codes', 'professors')
+HEADER = struct.Struct('<8sQ' + 'QQ' * len(SECTIONS))
+FIELD_SEP = '\x1f'
+
+CatalogProfessor = namedtuple('CatalogProfessor', 'id name department university')
+
+
+class ProfessorList:
+    """Read-only sequence of professors decoded from the mapped file on access."""
+
+    def __init__(self, buf, offset):
+        self._buf = buf
+        (self._count,) = struct.unpack_from('<I', buf, offset)
+        self._offsets = offset + 4
+        self._records = self._offsets + 4 * (self._count + 1)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        start, end = struct.unpack_from('<II', self._buf, self._offsets + 4 * i)
+        fields = bytes(self._buf[self._records + start:self._records + end]).decode('utf-8').split(FIELD_SEP)
+        return CatalogProfessor(int(fields[0]), fields[1], fields[2] or None, fields[3] or None)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self._mm, 0)
+        if fields[0] != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+        self.version = fields[1]
+        self._sections = {name: (fields[2 + 2 * i], fields[3 + 2 * i]) for i, name in enumerate(SECTIONS)}
+        self.professors = ProfessorList(self._mm, self._sections['professors'][0])
+        self._review_codes = None
+        self._review_code_set = None
+
+    def section(self, name):
+        offset, length = self._sections[name]
+        return self._mm[offset:offset + length]
+
+    @property
+    def review_course_codes(self):
+        if self._review_codes is None:
+            self._review_codes = json.loads(self.section('review_course_codes'))
+        return self._review_codes
+
+    @property
+    def review_code_set(self):
+        if self._review_code_set is None:
+            self._review_code_set = set(self.review_course_codes)
+        return self._review_code_set
+
+
+class CatalogSnapshot:
+    """Slow-changing catalog data (course codes, professor names) shared by all workers.
+
+    The snapshot is written once per change to a file that every worker maps
+    read-only, so the OS keeps one copy in memory however many workers there are.
+    Writers replace the file atomically (write + rename) with a bumped version;
+    readers notice the new inode on their next access and remap it. Rebuilds
+    take turns on a lock file, so a slower rebuild can't rename an older
+    snapshot over a newer one.
+    """
+
+    def __init__(self, db, professor, course, review):
+        self.db = db
+        self.professor = professor
+        self.course = course
+        self.review = review
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, shard_engines=None):
+        # Default file name is tied to the database URL so switching databases never
+        # serves another database's catalog
+        db_key = hashlib.sha1(str(app.config.get('SQLALCHEMY_DATABASE_URI')).encode()).hexdigest()[:10]
+        app.config.setdefault('CATALOG_SNAPSHOT_PATH', os.path.join(app.instance_path, f'catalog-{db_key}.snapshot'))
+        app.extensions['catalog'] = self
+        # Professors and reviews may be spread over several databases (see sharding.py)
+        self.shard_engines = shard_engines or (lambda: [self.db.engine])
+        self._snapshot = None
+
+    @property
+    def path(self):
+        return current_app.config['CATALOG_SNAPSHOT_PATH']
+
+    def current(self):
+        """The latest snapshot, remapping it if another process replaced the file."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.rebuild()
+            st = os.stat(self.path)
+        snap = self._snapshot
+        if snap is None or (snap.stat.st_ino, snap.stat.st_mtime_ns) != (st.st_ino, st.st_mtime_ns):
+            with self._lock:
+                snap = self._snapshot = Snapshot(self.path)
+        return snap
+
+    def rebuild(self):
+        """Query the catalog from the primary database (and shards) and atomically replace the file."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # flock locks belong to the open file, so this also serializes threads of one process
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        previous = 0
+        try:
+            previous = Snapshot(self.path).version
+        except (FileNotFoundError, ValueError):
+            pass
+
+        P, C, R = self.professor, self.course, self.review
+        with self.db.engine.connect() as conn:
+            api_codes = [row[0] for row in conn.execute(select(C.code).order_by(C.code.asc()))]
+        review_codes, profs = set(), []
+        for engine in self.shard_engines():
+            with engine.connect() as conn:
+                review_codes |= {row[0].strip() for row in conn.execute(select(R.course_code).distinct()) if row[0]}
+                profs += conn.execute(select(P.id, P.name, P.department, P.university)).all()
+        review_codes = sorted(review_codes)
+        profs.sort(key=lambda p: p[0])
+
+        records = [FIELD_SEP.join([str(pid), name or '', dept or '', univ or '']).encode('utf-8')
+                   for pid, name, dept, univ in profs]
+        offsets = [0]
+        for rec in records:
+            offsets.append(offsets[-1] + len(rec))
+        sections = [
+            json.dumps(api_codes or review_codes).encode('utf-8'),
+            json.dumps(review_codes).encode('utf-8'),
+            struct.pack(f'<I{len(offsets)}I', len(records), *offsets) + b''.join(records),
+        ]
+
+        header_fields = [MAGIC, previous + 1]
+        position = HEADER.size
+        for data in sections:
+            header_fields += [position, len(data)]
+            position += len(data)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(*header_fields))
+                for data in sections:
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def course_codes_json(self):
+        """Pre-rendered JSON body for /api/course_codes."""
+        return self.current().section('api_course_codes')
+
+    def review_course_codes(self):
+        return self.current().review_course_codes
+
+    def professors(self):
+        return self.current().professors
+
+    def is_new_course_code(self, code):
+        # Only reviews that introduce a new course code change the snapshot
+        return (code or '').strip() not in self.current().review_code_set
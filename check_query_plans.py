@@ -0,0 +1,208 @@
+"""Query-plan regression check for the hot routes.
+
+Seeds a scratch database with a few thousand rows, requests each hot route,
+captures every SQL statement it runs and EXPLAINs it. Fails (exit code 1) when
+a statement falls back to a full table scan that isn't expected for that route,
+or when a route runs more queries than its budget. The plans are written to
+query_plans/<dialect>.json so changes show up in review diffs.
+
+    python check_query_plans.py                                   # SQLite temp file
+    python check_query_plans.py --database-url postgresql://localhost/rmp_plans
+    python check_query_plans.py --update                          # rewrite the snapshot
+
+WARNING: every table in --database-url is dropped and recreated. Only point it
+at a scratch database.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, text
+
+from app import (create_app, db, bcrypt, rebuild_rating_rollups, recompute_similar_professors, Course,
+                 CourseReview, Professor, Review, ReviewReply, ReviewVote, User)
+
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_plans')
+PASSWORD = 'plans-password'
+
+# name, method, path, user to log in as, query budget, tables a full scan is expected on
+ROUTES = [
+    ('professor_detail', 'GET', '/professor/1', None, 7, ()),
+    ('professor_detail_logged_in', 'GET', '/professor/1?sort=most_positive', 'student', 8, ()),
+    ('professor_detail_course', 'GET', '/professor/1?course=CS 100', None, 8, ()),
+    ('similar_professors', 'GET', '/api/professors/1/similar', None, 3, ()),
+    # substring (ILIKE '%q%') search can't use a b-tree index
+    ('search', 'GET', '/search?q=Smith', None, 6, ('professors', 'reviews', 'courses')),
+    # matches a course code and a comment term: hundreds of reviews whose professors must load in bulk
+    ('search_course_code', 'GET', '/search?q=CS 100', None, 7, ('professors', 'reviews', 'courses')),
+    ('search_comment', 'GET', '/search?q=number 5', None, 7, ('professors', 'reviews', 'courses')),
+    ('professors_for_course', 'GET', '/api/professors_for_course?q=cs100', None, 2, ()),
+    ('course_detail', 'GET', '/course/CS 100', None, 5, ()),
+    # lists every review, so reading all replies in one pass (sorted like the reviews) is the intended plan
+    ('admin_reviews', 'GET', '/admin/reviews', 'admin', 2, ('review_replies',)),
+    ('vote_review', 'POST', '/vote/1/like', 'student', 5, ()),
+]
+
+
+def seed(scale):
+    rnd = random.Random(108)
+    db.drop_all()
+    db.create_all()
+    pw_hash = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    surnames = ['Smith', 'Nguyen', 'Garcia', 'Patel', 'Kim', 'Okafor', 'Rossi', 'Novak', 'Silva', 'Cohen']
+    codes = [f'{dept} {num}' for dept in ('CS', 'MATH', 'PHYS', 'HIST', 'BIO') for num in range(100, 500, 10)]
+    n_users, n_profs, n_reviews = 500 * scale, 2000 * scale, 20000 * scale
+
+    users = [{'username': f'user{i}', 'email': None, 'password_hash': pw_hash, 'role': 'student',
+              'review_deletion_count': 0} for i in range(n_users)]
+    users[0].update(username='student')
+    users[1].update(username='admin', role='admin')
+    db.session.execute(User.__table__.insert(), users)
+    db.session.execute(Professor.__table__.insert(), [
+        {'name': f'Dr. {rnd.choice("ABCDEFGHJK")}. {rnd.choice(surnames)}{i}', 'department': 'Dept',
+         'university': f'University {i % 20}'} for i in range(n_profs)])
+    db.session.execute(Course.__table__.insert(), [{'code': c} for c in codes])
+    start = datetime(2020, 1, 1)
+    reviews, terms = [], set()
+    while len(reviews) < n_reviews:
+        i = len(reviews)
+        review = {'user_id': rnd.randint(1, n_users), 'professor_id': 1 if i % 100 == 0 else rnd.randint(1, n_profs),
+                  'course_code': rnd.choice(codes), 'rating': rnd.randint(1, 5), 'comment': f'Review number {i}',
+                  'grade': rnd.choice(['A', 'B+', 'C', None]), 'semester': rnd.choice(['Fall', 'Spring']),
+                  'year': rnd.randint(2018, 2024), 'created_at': start + timedelta(minutes=i)}
+        # One review per user per professor, course and term (uq_reviews_user_course_term)
+        term = tuple(review[k] for k in ('user_id', 'professor_id', 'course_code', 'semester', 'year'))
+        if term not in terms:
+            terms.add(term)
+            reviews.append(review)
+    db.session.execute(Review.__table__.insert(), reviews)
+    # Each user reviews a course at most once (uq_course_reviews_user_term)
+    db.session.execute(CourseReview.__table__.insert(), [
+        {'user_id': i % n_users + 1, 'course_id': i // n_users % len(codes) + 1, 'rating': rnd.randint(1, 5),
+         'created_at': start + timedelta(minutes=i)} for i in range(n_reviews // 4)])
+    db.session.execute(ReviewVote.__table__.insert(), [
+        {'user_id': rnd.randint(1, n_users), 'review_id': rnd.randint(1, n_reviews), 'vote_type': rnd.choice([1, -1])}
+        for _ in range(n_reviews)])
+    db.session.execute(ReviewReply.__table__.insert(), [
+        {'user_id': rnd.randint(1, n_users), 'review_id': rnd.randint(1, n_reviews), 'comment': 'Thanks',
+         'created_at': start + timedelta(minutes=i)} for i in range(n_reviews // 10)])
+    db.session.commit()
+    rebuild_rating_rollups()
+    recompute_similar_professors()
+    with db.engine.begin() as conn:
+        conn.execute(text('ANALYZE'))
+
+
+def capture(app, method, path, username):
+    client = app.test_client()
+    if username:
+        client.post('/login', data={'username': username, 'password': PASSWORD})
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        # buffered: streamed pages run their queries while the body is read
+        response = client.open(path, method=method, buffered=True)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return response.status_code, statements
+
+
+def explain(conn, statement, parameters):
+    if conn.dialect.name == 'postgresql':
+        rows = conn.exec_driver_sql('EXPLAIN ' + statement, parameters).all()
+        return [r[0].strip() for r in rows]
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    return [r[-1] for r in rows]
+
+
+def full_scans(dialect, plan):
+    if dialect == 'postgresql':
+        pattern = re.compile(r'Seq Scan on (\w+)')
+    else:
+        pattern = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+    tables = set()
+    for line in plan:
+        m = pattern.search(line)
+        if m and m.group(1) != 'CONSTANT':
+            tables.add(m.group(1))
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', help='scratch database (default: temporary SQLite file)')
+    parser.add_argument('--scale', type=int, default=1, help='multiplier for the seeded row counts')
+    parser.add_argument('--update', action='store_true', help='rewrite the stored plan snapshot')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='query-plans-')
+    url = args.database_url or 'sqlite:///' + os.path.join(tmp, 'plans.db')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': url,
+        'DATABASE_REPLICA_URLS': '',
+        'CATALOG_SNAPSHOT_PATH': os.path.join(tmp, 'catalog.snapshot'),
+        'JINJA_BYTECODE_CACHE_DIR': None,
+    })
+
+    failures = []
+    results = {}
+    with app.app_context():
+        seed(args.scale)
+        dialect = db.engine.dialect.name
+        for name, method, path, username, budget, allowed in ROUTES:
+            status, statements = capture(app, method, path, username)
+            if status >= 400:
+                failures.append(f'{name}: {method} {path} returned {status}')
+            if len(statements) > budget:
+                failures.append(f'{name}: {len(statements)} queries, budget is {budget}')
+            plans = []
+            with db.engine.connect() as conn:
+                if dialect == 'postgresql':
+                    # Tiny tables make seq scans cheapest; this asks "could an index be used?"
+                    conn.exec_driver_sql('SET enable_seqscan = off')
+                for statement, parameters in statements:
+                    if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+                        continue
+                    plan = explain(conn, statement, parameters)
+                    plans.append({'statement': statement, 'plan': plan})
+                    for table in sorted(full_scans(dialect, plan) - set(allowed)):
+                        failures.append(f'{name}: full scan of {table} in\n    {statement}')
+            results[name] = {'queries': len(statements), 'budget': budget, 'plans': plans}
+
+    snapshot_path = os.path.join(SNAPSHOT_DIR, f'{dialect}.json')
+    if os.path.exists(snapshot_path) and not args.update:
+        with open(snapshot_path) as f:
+            previous = json.load(f)
+        for name, result in results.items():
+            if previous.get(name, {}).get('plans') != result['plans']:
+                print(f'note: plans for {name} differ from {snapshot_path} (run with --update to accept)')
+    if args.update or not os.path.exists(snapshot_path):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(snapshot_path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'wrote {snapshot_path}')
+
+    for name, result in results.items():
+        print(f"{name:30} {result['queries']:3d} queries (budget {result['budget']})")
+    if failures:
+        print('\nFAILED:')
+        for failure in failures:
+            print('  ' + failure)
+        sys.exit(1)
+    print('\nAll query plans OK.')
+
+
+if __name__ == '__main__':
+    main()
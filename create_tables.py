@@ -1,6 +1,10 @@
-from app import db, app
+from app import create_app, init_db
+
+app = create_app()
 
 with app.app_context():
-    db.create_all()
+    # Same as `flask init-db`: new columns, shard tables and indexes too, not just missing tables
+    for column in init_db():
+        print(f"Added column {column}.")
     print("✅ Database tables created successfully!")
-    print("You can now run your app normally.")
\ No newline at end of file
+    print("You can now run your app normally.")
@@ -0,0 +1,254 @@
+import random
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm.state import InstanceState
+
+from sharding import ShardingError, statement_tables
+
+
+# Sessions are cookie-backed, so this timestamp follows the user (logged in or not)
+# and lets us pin their reads to the primary right after they write something.
+STICKY_SESSION_KEY = '_db_last_write'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# session.info key of the shard that un-routed statements on sharded tables go to
+PINNED_SHARD_KEY = 'pinned_shard'
+# session.info key caching ShardRouter.stale_rows() for the session's lifetime (one request)
+STALE_ROWS_KEY = 'stale_shard_rows'
+
+
+def shard_of(obj):
+    """Shard an ORM object (or its state) was loaded from (or will be inserted into); None when unsharded."""
+    state = obj if isinstance(obj, InstanceState) else inspect(obj)
+    return state.key[2] if state.key is not None else state.identity_token
+
+
+class ReplicaRouter:
+    """Keeps track of read-replica engines and whether they are healthy.
+
+    Replicas are configured with DATABASE_REPLICA_URLS (comma separated). When none
+    are configured everything goes to the primary, exactly like before.
+    """
+
+    def __init__(self, app=None):
+        self.replicas = []
+        self.sticky_seconds = 5
+        self.health_interval = 10
+        self._health = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = app.config.get('DATABASE_REPLICA_URLS') or []
+        if isinstance(urls, str):
+            urls = [u.strip() for u in urls.split(',') if u.strip()]
+        self.replicas = [create_engine(url, pool_pre_ping=True) for url in urls]
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 5)
+        self.health_interval = app.config.get('REPLICA_HEALTH_INTERVAL', 10)
+        self._health = {}
+        app.extensions['replica_router'] = self
+
+        @app.before_request
+        def _choose_database():
+            g.use_replica = self.should_use_replica()
+
+        @app.after_request
+        def _remember_write(response):
+            # Any non-read request that didn't fail counts as a write for stickiness
+            if self.replicas and request.method not in READ_METHODS and response.status_code < 400:
+                session[STICKY_SESSION_KEY] = time.time()
+            return response
+
+    def should_use_replica(self):
+        if not self.replicas or request.method not in READ_METHODS:
+            return False
+        last_write = session.get(STICKY_SESSION_KEY)
+        if last_write and time.time() - last_write < self.sticky_seconds:
+            return False
+        return True
+
+    def is_healthy(self, engine):
+        # Cache the result of a cheap "SELECT 1" so we only probe every few seconds
+        now = time.time()
+        checked_at, healthy = self._health.get(engine, (0, True))
+        if now - checked_at < self.health_interval:
+            return healthy
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            healthy = True
+        except Exception:
+            healthy = False
+        self._health[engine] = (now, healthy)
+        return healthy
+
+    def pick_replica(self):
+        healthy = [e for e in self.replicas if self.is_healthy(e)]
+        if not healthy:
+            return None
+        return random.choice(healthy)
+
+
+class RoutingSession(Session):
+    """Session that sends reads to a replica during read-only requests.
+
+    Flushes and anything outside a request (CLI scripts, seed.py) always use the
+    primary. The chosen replica is kept for the rest of the request so one page
+    doesn't mix data from two replicas.
+
+    With shards configured (see sharding.ShardRouter), statements on sharded
+    tables go to the shard of the object they load from or write, to the shard
+    pinned with on_shard(), or to every shard with the results merged. Objects
+    remember their shard as the identity token of their identity key.
+    """
+
+    @property
+    def shard_router(self):
+        router = current_app.extensions.get('shard_router') if has_app_context() else None
+        return router if router is not None and router.enabled else None
+
+    @property
+    def connection_callable(self):
+        # Only set when sharding: the unit of work then asks for a connection per object
+        return self._shard_connection if self.shard_router is not None else None
+
+    def _shard_connection(self, mapper=None, instance=None, **kwargs):
+        return self.connection(bind_arguments={'mapper': mapper, 'instance': instance})
+
+    @contextmanager
+    def on_shard(self, shard):
+        """Send un-routed statements on sharded tables to one shard (None: no change)."""
+        previous = self.info.get(PINNED_SHARD_KEY)
+        if shard is not None:
+            self.info[PINNED_SHARD_KEY] = shard
+        try:
+            yield
+        finally:
+            self.info[PINNED_SHARD_KEY] = previous
+
+    def stale_rows(self):
+        if STALE_ROWS_KEY not in self.info:
+            self.info[STALE_ROWS_KEY] = self.shard_router.stale_rows()
+        return self.info[STALE_ROWS_KEY]
+
+    def shard_names(self):
+        """Every shard, or [None] when sharding is off (on_shard(None) is a no-op)."""
+        router = self.shard_router
+        return router.names if router is not None else [None]
+
+    def get_bind(self, mapper=None, clause=None, bind=None, shard_id=None, instance=None, **kwargs):
+        router = self.shard_router
+        if router is not None and bind is None and router.is_sharded(mapper, clause):
+            shard = shard_id or (shard_of(instance) if instance is not None else None) or self.info.get(PINNED_SHARD_KEY)
+            if shard is None:
+                raise ShardingError(f'No shard chosen for {clause if clause is not None else mapper}')
+            if shard != router.DEFAULT:
+                return router.engine(shard)
+        if bind is None and not self._flushing and has_request_context() and g.get('use_replica'):
+            router = current_app.extensions.get('replica_router')
+            if router is not None:
+                if 'replica_engine' not in g:
+                    g.replica_engine = router.pick_replica()
+                if g.replica_engine is not None:
+                    return g.replica_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _identity_lookup(self, mapper, primary_key_identity, identity_token=None, lazy_loaded_from=None, **kwargs):
+        router = self.shard_router
+        if router is None or identity_token is not None or not router.is_sharded(mapper):
+            return super()._identity_lookup(mapper, primary_key_identity, identity_token=identity_token,
+                                            lazy_loaded_from=lazy_loaded_from, **kwargs)
+        # session.get() doesn't know the shard: try the parent's shard first, then all of them
+        tokens = router.names
+        if lazy_loaded_from is not None and shard_of(lazy_loaded_from) in tokens:
+            tokens = [shard_of(lazy_loaded_from)] + tokens
+        for token in tokens:
+            obj = super()._identity_lookup(mapper, primary_key_identity, identity_token=token,
+                                           lazy_loaded_from=lazy_loaded_from, **kwargs)
+            if obj is not None:
+                return obj
+        return None
+
+    def shards_for(self, orm_context):
+        pinned = self.info.get(PINNED_SHARD_KEY)
+        if pinned:
+            return [pinned]
+        if orm_context.is_select:
+            if orm_context.load_options._identity_token:
+                return [orm_context.load_options._identity_token]
+            parent = orm_context.lazy_loaded_from
+            if parent is not None and shard_of(parent):
+                return [shard_of(parent)]
+        if orm_context.is_insert:
+            raise ShardingError('Bulk inserts into sharded tables need a shard: wrap them in session.on_shard()')
+        return self.shard_router.names
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute', retval=True)
+def route_to_shards(orm_context):
+    session = orm_context.session
+    router = session.shard_router
+    if router is None or 'shard_id' in orm_context.bind_arguments:
+        return None
+    tables = statement_tables(orm_context.statement)
+    if not tables & router.tables:
+        return None
+    if tables - router.tables:
+        raise ShardingError(f'Statement mixes sharded and global tables ({", ".join(sorted(tables))}); '
+                            'query them separately')
+    results = []
+    for shard in session.shards_for(orm_context):
+        if orm_context.is_select:
+            # Loaded objects are keyed by shard, so the same id on two shards never collides
+            orm_context.update_execution_options(identity_token=shard)
+        results.append(orm_context.invoke_statement(bind_arguments={'shard_id': shard}))
+    result = results[0] if len(results) == 1 else results[0].merge(*results[1:])
+    if orm_context.is_select and not session.info.get(PINNED_SHARD_KEY):
+        stale = session.stale_rows()
+        if stale:
+            result = drop_stale_rows(result, stale)
+    return result
+
+
+def drop_stale_rows(result, stale):
+    """`result` without rows holding an object from `stale` (a university's copy on the wrong shard).
+
+    Only loaded objects can be recognised; plain columns and aggregates pass through.
+    """
+    def is_stale(value):
+        state = inspect(value, raiseerr=False)
+        if not isinstance(state, InstanceState) or state.key is None:
+            return False
+        return (state.key[2], state.mapper.local_table.name, state.key[1][0]) in stale
+
+    frozen = result.freeze()
+    if frozen._source_supports_scalars:
+        # Single-entity results are stored as bare objects; with_new_rows() takes rows
+        rows = [(value,) for value in frozen.data if not is_stale(value)]
+    else:
+        rows = [row for row in frozen.data if not any(map(is_stale, row))]
+    return frozen.with_new_rows(rows)()
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def assign_shards(session, flush_context, instances):
+    router = session.shard_router
+    if router is None:
+        return
+    for obj in list(session.new):
+        if router.is_sharded(type(obj)):
+            state = inspect(obj)
+            state.identity_token = router.write_shard(session, obj)
+            if obj.id is None:
+                primary = session.connection(bind_arguments={'mapper': router.id_sequence})
+                obj.id = router.next_id(primary, state.mapper.local_table.name)
+    # Raise while the university of a changed or deleted row is being moved
+    for obj in session.dirty:
+        if router.is_sharded(type(obj)) and session.is_modified(obj):
+            router.write_shard(session, obj)
+    for obj in session.deleted:
+        if router.is_sharded(type(obj)):
+            router.write_shard(session, obj)
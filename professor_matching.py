@@ -0,0 +1,156 @@
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+
+# Titles and suffixes that shouldn't make two names look different
+IGNORED_WORDS = {'dr', 'prof', 'professor', 'mr', 'mrs', 'ms', 'miss', 'phd', 'jr', 'sr'}
+SIMILARITY_THRESHOLD = 0.5
+# Ids are handed out before commit, so a slow transaction can commit a lower id after
+# a higher one was indexed. Every REFRESH_WINDOW_SECONDS a refresh also re-reads this
+# many ids below the highest one seen.
+REFRESH_WINDOW = 1000
+REFRESH_WINDOW_SECONDS = 5
+
+
+def normalize_name(name):
+    words = re.sub(r"[^\w\s]", " ", (name or '').lower()).split()
+    return ' '.join(w for w in words if w not in IGNORED_WORDS)
+
+
+def trigrams(name):
+    """Word-padded character trigrams, the same scheme pg_trgm uses."""
+    grams = set()
+    for word in normalize_name(name).split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return frozenset(grams)
+
+
+def similarity(a, b):
+    # Jaccard similarity of two trigram sets
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class ProfessorMatcher:
+    """In-memory trigram index over professor names for "did you mean" lookups.
+
+    The index is loaded from the database on first use and then caught up on each
+    lookup by loading professors with an id above the highest one seen, so
+    profiles added by other workers show up without a rebuild. Ids just below it
+    are re-read every few seconds for rows that committed out of id order.
+    Lookups only score candidates that share one of the query's rarest trigrams
+    (prefix filtering), which keeps them to a few milliseconds even with 100k+
+    professors.
+    """
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.postings = defaultdict(set)   # trigram -> professor ids
+        self.grams = {}                    # professor id -> trigram set
+        self.universities = {}             # professor id -> normalized university
+        self.max_id = 0
+        self.window_read_at = 0
+
+    def add(self, prof_id, name, university=None):
+        grams = trigrams(name)
+        self.grams[prof_id] = grams
+        self.universities[prof_id] = (university or '').strip().lower()
+        for g in grams:
+            self.postings[g].add(prof_id)
+        self.max_id = max(self.max_id, prof_id)
+
+    def remove(self, prof_id):
+        for g in self.grams.pop(prof_id, ()):
+            self.postings[g].discard(prof_id)
+        self.universities.pop(prof_id, None)
+
+    def refresh(self):
+        """Load professors inserted since the last refresh (or everything, the first time)."""
+        with self._lock:
+            after = self.max_id
+            if time.monotonic() - self.window_read_at >= REFRESH_WINDOW_SECONDS:
+                after -= REFRESH_WINDOW
+                self.window_read_at = time.monotonic()
+            rows = (self.db.session.query(self.model.id, self.model.name, self.model.university)
+                    .filter(self.model.id > after)
+                    .order_by(self.model.id)
+                    .all())
+            for prof_id, name, university in rows:
+                if prof_id not in self.grams:
+                    self.add(prof_id, name, university)
+
+    def rebuild(self):
+        with self._lock:
+            self._reset()
+        self.refresh()
+
+    def _lookup(self, query, threshold):
+        # Any match needs at least ceil(threshold * |query|) shared trigrams, so it
+        # must contain one of the (|query| - that + 1) rarest query trigrams.
+        min_shared = max(1, math.ceil(threshold * len(query)))
+        rarest = sorted(query, key=lambda g: len(self.postings.get(g, ())))
+        ids = set()
+        for g in rarest[:len(query) - min_shared + 1]:
+            ids.update(self.postings.get(g, ()))
+        for prof_id in ids:
+            score = similarity(query, self.grams[prof_id])
+            if score >= threshold:
+                yield prof_id, score
+
+    def candidates(self, name, university=None, limit=5, threshold=SIMILARITY_THRESHOLD):
+        """Return [(professor_id, score)] best first, same university ranked first."""
+        self.refresh()
+        query = trigrams(name)
+        if not query:
+            return []
+        university = (university or '').strip().lower()
+        scored = []
+        for prof_id, score in self._lookup(query, threshold):
+            same_school = bool(university) and self.universities.get(prof_id) == university
+            scored.append((same_school, score, prof_id))
+        scored.sort(reverse=True)
+        return [(prof_id, round(score, 3)) for _same, score, prof_id in scored[:limit]]
+
+    def suggest(self, name, university=None, limit=5, threshold=SIMILARITY_THRESHOLD):
+        """Like candidates() but returns Professor rows (skipping any deleted since indexing)."""
+        matches = self.candidates(name, university, limit=limit, threshold=threshold)
+        if not matches:
+            return []
+        rows = {p.id: p for p in self.model.query.filter(self.model.id.in_([m[0] for m in matches])).all()}
+        for prof_id in [m[0] for m in matches if m[0] not in rows]:
+            self.remove(prof_id)
+        return [(rows[prof_id], score) for prof_id, score in matches if prof_id in rows]
+
+    def find_duplicate(self, name, university=None):
+        """Best existing professor at the same (or an unknown) university, or None."""
+        university = (university or '').strip().lower()
+        for prof, score in self.suggest(name, university):
+            prof_university = (prof.university or '').strip().lower()
+            if not university or not prof_university or prof_university == university:
+                return prof
+        return None
+
+    def duplicate_pairs(self, threshold=0.8):
+        """Yield (keep_id, duplicate_id, score) for every likely duplicate pair.
+
+        The lower id is kept since it usually has the longer review history.
+        """
+        self.refresh()
+        for prof_id in sorted(self.grams):
+            university = self.universities.get(prof_id)
+            for other_id, score in self._lookup(self.grams[prof_id], threshold):
+                other_university = self.universities.get(other_id)
+                if other_id > prof_id and (not university or not other_university or university == other_university):
+                    yield prof_id, other_id, round(score, 3)
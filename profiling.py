@@ -0,0 +1,179 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, jsonify, request, template_rendered, before_render_template
+from flask_login import current_user
+from sqlalchemy import event
+
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = '_profile'
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack every `interval` seconds.
+
+    Stacks are counted in the "collapsed" format (root;...;leaf -> count) that
+    flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfiler:
+    """Admin-only, per-request profiling.
+
+    An admin adds `X-Profile: 1` or `?_profile=1` to a request and gets a report
+    with a stack-sampled flamegraph, every SQL statement with its time, and how
+    long each template took to render. Reports are saved under
+    instance/profiles and linked from the X-Profile-Report response header;
+    `?_profile=json` returns the report instead of the page.
+
+    Nothing is hooked up for requests that don't ask for it: the SQL listeners,
+    template signals and sampler thread exist only while a profiled request runs.
+    """
+
+    def __init__(self, app=None, engines=None):
+        if app is not None:
+            self.init_app(app, engines)
+
+    def init_app(self, app, engines=None):
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILE_SAMPLE_INTERVAL', 0.001)
+        app.extensions['profiler'] = self
+        self.engines = engines or (lambda: [])
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._cleanup)
+
+    def _requested(self):
+        # Check the flag first so normal requests never even load current_user here
+        flag = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+        return bool(flag) and current_user.is_authenticated and getattr(current_user, 'role', None) == 'admin'
+
+    def _start(self):
+        if not self._requested():
+            return
+        app = current_app._get_current_object()
+        report = {'method': request.method, 'path': request.full_path, 'sql': [], 'templates': []}
+        render_starts = []
+        # Listeners and signals are process-wide; only count this request's thread
+        thread_id = threading.get_ident()
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if threading.get_ident() == thread_id:
+                conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            starts = conn.info.get('profile_query_start')
+            if threading.get_ident() != thread_id or not starts:
+                # Another thread's query, or one that started before the listeners were added
+                return
+            started = starts.pop()
+            report['sql'].append({'statement': statement, 'parameters': repr(parameters)[:500],
+                                  'ms': round((time.perf_counter() - started) * 1000, 3)})
+
+        def before_render(sender, template, context, **extra):
+            if threading.get_ident() == thread_id:
+                render_starts.append(time.perf_counter())
+
+        def rendered(sender, template, context, **extra):
+            if threading.get_ident() != thread_id:
+                return
+            started = render_starts.pop() if render_starts else time.perf_counter()
+            report['templates'].append({'name': template.name, 'ms': round((time.perf_counter() - started) * 1000, 3)})
+
+        engines = list(self.engines())
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+        before_render_template.connect(before_render, app)
+        template_rendered.connect(rendered, app)
+
+        def unhook():
+            for engine in engines:
+                event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+                event.remove(engine, 'after_cursor_execute', after_cursor_execute)
+            before_render_template.disconnect(before_render, app)
+            template_rendered.disconnect(rendered, app)
+
+        sampler = StackSampler(thread_id, app.config['PROFILE_SAMPLE_INTERVAL'])
+        g.profile = {'report': report, 'unhook': unhook, 'sampler': sampler, 'started': time.perf_counter()}
+        sampler.start()
+
+    def _stop(self):
+        state = g.pop('profile', None)
+        if state is None:
+            return None
+        state['sampler'].stop()
+        state['unhook']()
+        report = state['report']
+        report['total_ms'] = round((time.perf_counter() - state['started']) * 1000, 3)
+        report['sql_count'] = len(report['sql'])
+        report['sql_ms'] = round(sum(q['ms'] for q in report['sql']), 3)
+        report['template_ms'] = round(sum(t['ms'] for t in report['templates']), 3)
+        report['sample_interval_ms'] = current_app.config['PROFILE_SAMPLE_INTERVAL'] * 1000
+        report['collapsed_stacks'] = '\n'.join(f"{stack} {count}" for stack, count in state['sampler'].stacks.most_common())
+        return report
+
+    def _finish(self, response):
+        if 'profile' in g and response.is_streamed:
+            # Streamed pages query and render while the body is read; do that now, while measured
+            response.make_sequence()
+        report = self._stop()
+        if report is None:
+            return response
+        report['status'] = response.status_code
+        name = self.save(report)
+        if (request.args.get(PROFILE_ARG) or '').lower() == 'json':
+            response = jsonify(report)
+        response.headers['X-Profile-Report'] = f'/admin/profiles/{name}'
+        return response
+
+    def _cleanup(self, exc):
+        # Make sure listeners and the sampler go away even if the view raised
+        self._stop()
+
+    def save(self, report):
+        directory = current_app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        slug = ''.join(c if c.isalnum() else '-' for c in (request.endpoint or 'request'))
+        name = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{slug}"
+        with open(os.path.join(directory, name + '.json'), 'w') as f:
+            json.dump(report, f, indent=1)
+        return name
+
+    def load(self, name):
+        # Names are generated by save(); refuse anything that could escape the directory
+        if not name or not all(c.isalnum() or c in '-_' for c in name):
+            return None
+        path = os.path.join(current_app.config['PROFILE_DIR'], name + '.json')
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
@@ -0,0 +1,184 @@
+import re
+import zlib
+
+import numpy as np
+
+
+# Feature blocks of a professor vector. Courses, departments and comment terms are
+# hashed into a fixed number of buckets so the matrix stays dense and small.
+RATING_DIMS = 5
+COURSE_DIMS = 128
+DEPARTMENT_DIMS = 32
+TERM_DIMS = 256
+# Share of the cosine score each block contributes when both professors have it
+BLOCK_WEIGHTS = {'ratings': 0.3, 'courses': 0.25, 'department': 0.1, 'terms': 0.35}
+TOP_K = 5
+# Rows of the similarity matrix computed at once: BATCH_ROWS x group size floats
+BATCH_ROWS = 1024
+# Most professors compared within one course. Bigger courses (intro classes) are split
+# by department, then into random chunks, so the work stays linear in the course size.
+MAX_GROUP_SIZE = 2000
+# Comments tokenized and added to the matrix at once
+COMMENT_BATCH = 10000
+# Terms are lowercase words of 3+ letters outside STOP_WORDS. Batches of comments are
+# joined with a separator, which the pattern also matches so terms can be traced back.
+COMMENT_SEPARATOR = '\x00'
+TERM_PATTERN = re.compile(r"[a-z]{3,}|\x00")
+
+STOP_WORDS = frozenset('''
+    the and for that this with was but are not you his her she they have had has from
+    him very all class course professor prof teacher lecture lectures really just would
+    will can its our out one about more also get got when what there their which
+    who were been being into than then them too any some much most make made take took
+'''.split())
+
+
+def bucket(token, dims):
+    # crc32 rather than hash(): str hashes are salted per process
+    return zlib.crc32(token.encode('utf-8')) % dims
+
+
+class FeatureBuilder:
+    """Accumulates per-professor features, then builds the normalized matrix.
+
+    Feed it aggregate rows from the database (rating counts, course counts) and
+    raw comments; `matrix()` returns one L2-normalized row per professor.
+    """
+
+    def __init__(self, professor_ids):
+        self.ids = np.asarray(professor_ids, dtype=np.int64)
+        self.row = {pid: i for i, pid in enumerate(professor_ids)}
+        n = len(self.ids)
+        self.blocks = {
+            'ratings': np.zeros((n, RATING_DIMS), dtype=np.float32),
+            'courses': np.zeros((n, COURSE_DIMS), dtype=np.float32),
+            'department': np.zeros((n, DEPARTMENT_DIMS), dtype=np.float32),
+            'terms': np.zeros((n, TERM_DIMS), dtype=np.float32),
+        }
+        self.course_members = {}  # normalized course code -> row indices
+        self.department_keys = np.full(n, -1, dtype=np.int64)  # crc32 of the department, -1 when unknown
+        # word -> terms bucket; stop words map to -1 and the comment separator to -2
+        self._term_bucket_of = {COMMENT_SEPARATOR: -2}
+
+    def add_department(self, professor_id, department):
+        department = (department or '').strip().lower()
+        if department and professor_id in self.row:
+            self.blocks['department'][self.row[professor_id], bucket(department, DEPARTMENT_DIMS)] = 1
+            self.department_keys[self.row[professor_id]] = zlib.crc32(department.encode('utf-8'))
+
+    def add_rating_count(self, professor_id, rating, count):
+        if professor_id in self.row and rating and 1 <= rating <= RATING_DIMS:
+            self.blocks['ratings'][self.row[professor_id], rating - 1] += count
+
+    def add_course_count(self, professor_id, course_code, count):
+        if professor_id not in self.row or not course_code:
+            return
+        i = self.row[professor_id]
+        self.blocks['courses'][i, bucket(course_code, COURSE_DIMS)] += count
+        self.course_members.setdefault(course_code, []).append(i)
+
+    def add_comments(self, rows):
+        """Count the terms of (professor id, comment) rows, one batch of comments at a time."""
+        batch = []
+        for professor_id, comment in rows:
+            if comment and professor_id in self.row:
+                batch.append((self.row[professor_id], comment))
+                if len(batch) == COMMENT_BATCH:
+                    self._add_comment_batch(batch)
+                    batch = []
+        self._add_comment_batch(batch)
+
+    def _add_comment_batch(self, batch):
+        if not batch:
+            return
+        comments = [comment for _row, comment in batch]
+        text = COMMENT_SEPARATOR.join(comments)
+        if text.count(COMMENT_SEPARATOR) != len(comments) - 1:
+            text = COMMENT_SEPARATOR.join(c.replace(COMMENT_SEPARATOR, ' ') for c in comments)
+        # One regex pass over the whole batch; each distinct word is hashed once
+        tokens = TERM_PATTERN.findall(text.lower())
+        bucket_of = self._term_bucket_of
+        for term in set(tokens).difference(bucket_of):
+            bucket_of[term] = -1 if term in STOP_WORDS else bucket(term, TERM_DIMS)
+        codes = np.fromiter(map(bucket_of.__getitem__, tokens), dtype=np.int64, count=len(tokens))
+        # Separators between comments tell which comment (and so which row) each term came from
+        comment_of = np.cumsum(codes == -2)
+        rows = np.fromiter((row for row, _comment in batch), dtype=np.int64, count=len(batch))
+        keep = codes >= 0
+        cells, counts = np.unique(rows[comment_of[keep]] * TERM_DIMS + codes[keep], return_counts=True)
+        self.blocks['terms'].reshape(-1)[cells] += counts
+
+    def matrix(self):
+        parts = []
+        for name, block in self.blocks.items():
+            if name in ('courses', 'terms'):
+                # Dampen heavy hitters so one very popular course or word doesn't dominate
+                block = np.log1p(block)
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            parts.append(np.divide(block, norms, out=np.zeros_like(block), where=norms > 0)
+                         * np.float32(np.sqrt(BLOCK_WEIGHTS[name])))
+        features = np.hstack(parts)
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        return np.divide(features, norms, out=np.zeros_like(features), where=norms > 0)
+
+    def groups(self):
+        """Row indices of the professors of each course, big courses split to at most MAX_GROUP_SIZE."""
+        rng = np.random.default_rng(0)  # fixed seed: the same data gives the same neighbours
+        groups = []
+        for rows in self.course_members.values():
+            members = np.unique(np.asarray(rows, dtype=np.int64))
+            if len(members) <= MAX_GROUP_SIZE:
+                groups.append(members)
+                continue
+            departments = self.department_keys[members]
+            for department in np.unique(departments):
+                block = members[departments == department]
+                chunks = -(-len(block) // MAX_GROUP_SIZE)
+                if chunks > 1:
+                    block = rng.permutation(block)
+                groups += [np.sort(chunk) for chunk in np.array_split(block, chunks)]
+        return groups
+
+
+def top_k_similar(features, groups, k=TOP_K):
+    """Top-k cosine neighbours of every row among rows that share a group with it.
+
+    Only professors who share a group are compared, so the work is the sum of
+    squared group sizes rather than N^2 (FeatureBuilder.groups() keeps groups
+    small). Each group's similarities are computed as batched matrix products;
+    per-group winners are then merged and deduplicated across groups. Returns
+    (rows, neighbours, scores, ranks) arrays with at most k entries per row, best
+    first (rank 0).
+    """
+    rows, cols, scores = [], [], []
+    for members in groups:
+        if len(members) < 2:
+            continue
+        kk = min(k, len(members) - 1)
+        group_features = features[members]
+        for start in range(0, len(members), BATCH_ROWS):
+            batch = np.arange(start, min(start + BATCH_ROWS, len(members)))
+            sims = group_features[batch] @ group_features.T
+            sims[np.arange(len(batch)), batch] = -np.inf  # not your own neighbour
+            best = np.argpartition(-sims, kk - 1, axis=1)[:, :kk]
+            rows.append(np.repeat(members[batch], kk))
+            cols.append(members[best].ravel())
+            scores.append(np.take_along_axis(sims, best, axis=1).ravel())
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float32), empty
+    rows, cols, scores = np.concatenate(rows), np.concatenate(cols), np.concatenate(scores)
+
+    # A pair found through several shared courses appears once per course
+    keep = scores > 0
+    rows, cols, scores = rows[keep], cols[keep], scores[keep]
+    _, first = np.unique(rows * len(features) + cols, return_index=True)
+    rows, cols, scores = rows[first], cols[first], scores[first]
+
+    # Best first within each row, then cut every row to k
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    starts = np.searchsorted(rows, rows, side='left')
+    rank = np.arange(len(rows)) - starts
+    keep = rank < k
+    return rows[keep], cols[keep], scores[keep], rank[keep]
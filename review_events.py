@@ -0,0 +1,190 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import Response, current_app
+
+
+log = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Bounded buffer of events for one open stream.
+
+    A slow client never makes publishers wait or grows memory without limit: once
+    `maxsize` events are queued the oldest are dropped and the client is told to
+    resync (reload) instead.
+    """
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.maxsize = maxsize
+        self.events = deque()
+        self.dropped = 0
+        self._cond = threading.Condition()
+
+    def put(self, event):
+        with self._cond:
+            if len(self.events) >= self.maxsize:
+                self.events.popleft()
+                self.dropped += 1
+            self.events.append(event)
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Next event, a 'resync' event after an overflow, or None after `timeout` seconds."""
+        with self._cond:
+            if not self.events and not self.dropped:
+                self._cond.wait(timeout)
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                self.events.clear()
+                return {'event': 'resync', 'data': {'dropped': dropped}}
+            return self.events.popleft() if self.events else None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBackend:
+    """Delivers events to streams in this process only (one worker, or tests)."""
+
+    local = True
+
+    def __init__(self, url, deliver):
+        self.deliver = deliver
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def start(self):
+        pass
+
+
+class RedisBackend:
+    """Fans events out to every worker through Redis pub/sub (needs the redis package)."""
+
+    PREFIX = 'review-events:'
+    local = False
+
+    def __init__(self, url, deliver):
+        import redis  # optional; only needed when REVIEW_EVENTS_URL points at Redis
+        self.client = redis.Redis.from_url(url)
+        self.deliver = deliver
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        self.client.publish(self.PREFIX + channel, message)
+
+    def start(self):
+        # Started on the first subscription, so it runs in the worker rather than a pre-fork master
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='review-events', daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.PREFIX + '*')
+                for message in pubsub.listen():
+                    self.deliver(message['channel'].decode()[len(self.PREFIX):], message['data'])
+            except Exception:
+                log.exception('Review event listener lost its Redis connection; reconnecting')
+                time.sleep(1)
+
+
+# URL scheme -> backend class; register other shared backends here
+BACKENDS = {'memory': MemoryBackend, 'redis': RedisBackend, 'rediss': RedisBackend}
+
+
+class ReviewEvents:
+    """In-process pub/sub of new reviews and replies, streamed to dashboards as SSE.
+
+    Publishers call publish(channel, event, data) (app.py does so after a commit
+    that adds or deletes reviews); each open stream holds a Subscription to one
+    channel. REVIEW_EVENTS_URL picks the backend that carries events between
+    processes: "memory://" (default) only reaches streams in the same worker,
+    "redis://host:6379/0" reaches every worker.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REVIEW_EVENTS_URL', 'memory://')
+        app.config.setdefault('REVIEW_EVENTS_BUFFER', 100)  # events queued per open stream
+        app.config.setdefault('REVIEW_EVENTS_KEEPALIVE', 15)  # seconds between keepalive comments
+        url = app.config['REVIEW_EVENTS_URL'] or 'memory://'
+        scheme = url.split(':', 1)[0]
+        if scheme not in BACKENDS:
+            raise ValueError(f'Unknown REVIEW_EVENTS_URL scheme {scheme!r}; expected one of {", ".join(BACKENDS)}')
+        self.backend = BACKENDS[scheme](url, self._deliver)
+        self._subscribers = {}
+        app.extensions['review_events'] = self
+
+    def publish(self, channel, event, data):
+        try:
+            self.backend.publish(channel, json.dumps({'event': event, 'data': data}, default=str))
+        except Exception:
+            # Live updates are best effort; the write they describe is already committed
+            log.exception('Could not publish %s event on %s', event, channel)
+
+    def wants(self, channel):
+        """False when nobody can be listening, so publishers can skip building the event."""
+        return not self.backend.local or channel in self._subscribers
+
+    def subscribe(self, channel, maxsize):
+        self.backend.start()
+        subscription = Subscription(self, channel, maxsize)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def _deliver(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        if subscribers:
+            event = json.loads(message)
+            for subscription in subscribers:
+                subscription.put(event)
+
+    def stream(self, channel):
+        """text/event-stream response that relays `channel` until the client disconnects."""
+        subscription = self.subscribe(channel, current_app.config['REVIEW_EVENTS_BUFFER'])
+        keepalive = current_app.config['REVIEW_EVENTS_KEEPALIVE']
+
+        def generate():
+            try:
+                yield 'retry: 5000\n\n'
+                while True:
+                    event = subscription.get(keepalive)
+                    if event is None:
+                        # Comment line: keeps proxies from timing out and notices closed connections
+                        yield ': keepalive\n\n'
+                    else:
+                        yield f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+            finally:
+                subscription.close()
+
+        response = Response(generate(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # nginx: don't buffer the stream
+        return response
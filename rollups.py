@@ -0,0 +1,101 @@
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+GRADE_BUCKETS = ('a', 'b', 'c', 'd', 'f')
+SEMESTER_ORDER = {'Spring': 1, 'Summer': 2, 'Fall': 3}
+COUNT_COLUMNS = ('review_count', 'rating_sum') + tuple(f'grade_{b}' for b in GRADE_BUCKETS) + ('grade_other',)
+
+
+def grade_bucket(grade):
+    """Map 'A-', 'b+', 'F' ... to a rollup column, or None when no grade was given."""
+    grade = (grade or '').strip().lower()
+    if not grade:
+        return None
+    if grade[0] in GRADE_BUCKETS:
+        return f'grade_{grade[0]}'
+    return 'grade_other'
+
+
+def review_increments(review, sign):
+    """Counter deltas for adding (sign=1) or removing (sign=-1) one review."""
+    increments = {c: 0 for c in COUNT_COLUMNS}
+    increments['review_count'] = sign
+    increments['rating_sum'] = sign * (review.rating or 0)
+    bucket = grade_bucket(review.grade)
+    if bucket:
+        increments[bucket] = sign
+    return increments
+
+
+def term_keys(review):
+    # year 0 / semester '' stand for "not given" so they still fit the unique key
+    return {'year': review.year or 0, 'semester': review.semester or ''}
+
+
+def upsert_increment(conn, table, keys, increments):
+    """Add increments to the rollup row identified by keys, creating it if needed.
+
+    Runs as a single INSERT ... ON CONFLICT DO UPDATE so concurrent writers can't
+    lose each other's counts.
+    """
+    dialect = postgresql if conn.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table).values(**keys, **increments)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={c: table.c[c] + stmt.excluded[c] for c in increments},
+    )
+    conn.execute(stmt)
+
+
+def aggregate_columns(rating, grade):
+    """SQL expressions computing every counter column over a group of reviews.
+
+    Used to rebuild rollups in one GROUP BY instead of replaying reviews one by one.
+    """
+    first_letter = func.lower(func.substr(func.trim(grade), 1, 1))
+    columns = [func.count().label('review_count'), func.coalesce(func.sum(rating), 0).label('rating_sum')]
+    for b in GRADE_BUCKETS:
+        columns.append(func.coalesce(func.sum(case((first_letter == b, 1), else_=0)), 0).label(f'grade_{b}'))
+    other = case((first_letter.in_(GRADE_BUCKETS), 0), (func.coalesce(func.trim(grade), '') == '', 0), else_=1)
+    columns.append(func.coalesce(func.sum(other), 0).label('grade_other'))
+    return columns
+
+
+def term_columns(year, semester):
+    # Unlabeled so the same expressions can be used in GROUP BY
+    return func.coalesce(year, 0), func.coalesce(semester, '')
+
+
+def trend_rows(rows):
+    """Turn rollup rows (any objects/rows with the counter columns) into per-term dicts.
+
+    Rows for the same year/semester (e.g. several courses) are summed together and
+    the result is ordered oldest term first.
+    """
+    terms = {}
+    for row in rows:
+        key = (row.year or 0, row.semester or '')
+        term = terms.setdefault(key, {c: 0 for c in COUNT_COLUMNS})
+        for c in COUNT_COLUMNS:
+            term[c] += getattr(row, c) or 0
+    out = []
+    for (year, semester), counts in sorted(terms.items(), key=lambda t: (t[0][0], SEMESTER_ORDER.get(t[0][1], 0))):
+        if counts['review_count'] <= 0:
+            continue
+        out.append({
+            'year': year or None,
+            'semester': semester or None,
+            'label': ' '.join(str(p) for p in (semester, year or '') if p) or 'Unspecified',
+            'review_count': counts['review_count'],
+            'avg_rating': round(counts['rating_sum'] / counts['review_count'], 2),
+            'grades': {b.upper(): counts[f'grade_{b}'] for b in GRADE_BUCKETS} | {'Other': counts['grade_other']},
+        })
+    return out
+
+
+def rating_summary(rows):
+    """(review count, average rating to one decimal) summed over rollup rows."""
+    count = sum(row.review_count or 0 for row in rows)
+    total = sum(row.rating_sum or 0 for row in rows)
+    return count, round(total / count, 1) if count else 0
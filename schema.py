@@ -0,0 +1,35 @@
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+
+def sync_schema(engine, metadata):
+    """Bring a database up to `metadata` without touching existing rows.
+
+    Creates missing tables, adds nullable columns that were added to a model after
+    its table was created, then creates missing indexes. Anything else (new NOT
+    NULL columns, type changes) needs a real migration. Returns the added columns
+    as "table.column" strings.
+    """
+    metadata.create_all(engine)
+    dialect = engine.dialect
+    quote = dialect.identifier_preparer
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise ValueError(f'{table.name}.{column.name} is NOT NULL; add it with a migration')
+                conn.exec_driver_sql(f'ALTER TABLE {quote.format_table(table)} '
+                                     f'ADD COLUMN {quote.format_column(column)} {column.type.compile(dialect)}')
+                added.append(f'{table.name}.{column.name}')
+    # IF NOT EXISTS rather than checkfirst: SQLite can't reflect expression indexes.
+    # One transaction each, so one index that can't be built doesn't undo the others.
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            with engine.begin() as conn:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+    return added
@@ -1,10 +1,17 @@
-from app import app, db, Professor, User, Review, bcrypt
+from app import create_app, db, shard_router, Professor, User, Review, bcrypt
+
+app = create_app()
 
 def seed_data():
     with app.app_context():
         # 1. Drop everything to start fresh (Optional - remove if you want to keep old data)
         db.drop_all()
         db.create_all()
+        # With DATABASE_SHARDS set, the shard databases start fresh too
+        shard_metadata = shard_router.shard_metadata()
+        for engine in shard_router.engines.values():
+            shard_metadata.drop_all(engine)
+        shard_router.create_all()
 
         # 2. Create Dummy Professors
         profs = [
@@ -0,0 +1,315 @@
+import time
+
+from flask import jsonify
+from sqlalchemy import ForeignKeyConstraint, MetaData, Table, create_engine, delete, func, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.util import find_tables
+
+from schema import sync_schema
+
+
+class ShardingError(RuntimeError):
+    """A statement or write that can't be routed to one known shard."""
+
+
+class UniversityMoving(ShardingError):
+    """Writes for a university are paused while move-university copies its rows."""
+
+
+def university_key(university):
+    # Professor.university is free text; "MIT " and "mit" are the same school
+    return (university or '').strip().lower()
+
+
+def statement_tables(statement):
+    """Names of the tables a Core/ORM statement reads or writes."""
+    return {t.name for t in find_tables(statement, include_crud=True, include_joins=True) if isinstance(t, Table)}
+
+
+def table_name(mapper):
+    # get_bind() receives a mapper, a mapped class or (from Core) a Table
+    target = inspect(mapper)
+    table = getattr(target, 'local_table', target)
+    return getattr(table, 'name', None)
+
+
+class ShardRouter:
+    """Spreads professor data over per-university shard databases.
+
+    Shards are configured with DATABASE_SHARDS ("east=postgresql://...,west=...").
+    The primary database (SQLALCHEMY_DATABASE_URI) keeps the global tables (users,
+    courses, the shard map) and is also the "default" shard for every university
+    that isn't mapped elsewhere. When no shards are configured nothing is routed
+    and everything stays on the primary, exactly like before.
+
+    Root models are registered with shard_by() (their university picks the shard);
+    dependent models with shard_with() (stored next to their parent row). Ids of
+    sharded rows come from one sequence table on the primary, so they are unique
+    across shards and survive a university moving between them.
+    """
+
+    DEFAULT = 'default'
+
+    def __init__(self, db, shard_map, id_sequence):
+        self.db = db
+        self.shard_map = shard_map
+        self.id_sequence = id_sequence
+        self.roots = {}  # model -> name of its university attribute
+        self.parents = {}  # model -> (parent model, name of the foreign key attribute)
+        self.local_ids = set()  # models whose ids come from each shard's own autoincrement
+        self.engines = {}
+        self.map_ttl = 30
+        self._map = None
+        self._map_loaded = 0
+
+    def init_app(self, app):
+        urls = app.config.get('DATABASE_SHARDS') or {}
+        if isinstance(urls, str):
+            urls = dict(part.split('=', 1) for part in urls.split(',') if part.strip())
+        urls = {name.strip(): url.strip() for name, url in urls.items()}
+        if self.DEFAULT in urls:
+            raise ValueError(f'"{self.DEFAULT}" is the primary database; give the other shards different names')
+        self.engines = {name: create_engine(url, pool_pre_ping=True) for name, url in urls.items()}
+        self.map_ttl = app.config.get('SHARD_MAP_TTL', 30)
+        self._map = None
+        app.extensions['shard_router'] = self
+
+        @app.errorhandler(UniversityMoving)
+        def _university_moving(error):
+            response = jsonify({'status': 'error', 'message': str(error)})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(self.map_ttl)
+            return response
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    # --- which models live on shards ---
+
+    def shard_by(self, model, university_attr):
+        self.roots[model] = university_attr
+
+    def shard_with(self, model, parent, foreign_key, local_ids=False):
+        # local_ids: rows written with Core (the rollups) take ids from the shard's own
+        # autoincrement, so the same id can exist on every shard
+        self.parents[model] = (parent, foreign_key)
+        if local_ids:
+            self.local_ids.add(model)
+
+    @property
+    def tables(self):
+        return {model.__table__.name for model in list(self.roots) + list(self.parents)}
+
+    def is_sharded(self, mapper=None, clause=None):
+        if mapper is not None:
+            return table_name(mapper) in self.tables
+        if clause is not None:
+            return bool(statement_tables(clause) & self.tables)
+        return False
+
+    # --- shards and the university map ---
+
+    @property
+    def names(self):
+        return [self.DEFAULT] + list(self.engines)
+
+    def engine(self, name):
+        if name == self.DEFAULT:
+            return self.db.engine
+        try:
+            return self.engines[name]
+        except KeyError:
+            raise ShardingError(f'Unknown shard {name!r}; configured shards are {", ".join(self.names)}') from None
+
+    def all_engines(self):
+        return [self.engine(name) for name in self.names]
+
+    def university_map(self):
+        """{university key: (shard, moving)}, re-read from the primary every SHARD_MAP_TTL seconds."""
+        now = time.monotonic()
+        if self._map is None or now - self._map_loaded > self.map_ttl:
+            T = self.shard_map
+            with self.db.engine.connect() as conn:
+                rows = conn.execute(select(T.university_key, T.shard, T.moving)).all()
+            self._map = {key: (shard, bool(moving)) for key, shard, moving in rows}
+            self._map_loaded = now
+        return self._map
+
+    def shard_for_university(self, university):
+        return self.university_map().get(university_key(university), (self.DEFAULT, False))[0]
+
+    def stale_rows(self):
+        """{(shard, table, id)} of rows a university that is being moved has on a shard it isn't mapped to.
+
+        While a move runs, its rows exist on both shards for a while; merged reads
+        skip these so every row shows up once. Empty (and no queries) when nothing moves.
+        """
+        stale = set()
+        for key, (owner, moving) in self.university_map().items():
+            if not moving:
+                continue
+            for name in self.names:
+                if name != owner:
+                    with self.engine(name).connect() as conn:
+                        for model, ids in self._rows_to_move(conn, key).items():
+                            stale.update((name, model.__table__.name, id_) for id_ in ids)
+        return stale
+
+    def check_writable(self, university):
+        if self.university_map().get(university_key(university), (None, False))[1]:
+            raise UniversityMoving(f'{university} is being moved to another database; please try again shortly.')
+
+    def write_shard(self, session, obj):
+        """Shard a new or changed sharded object belongs on; raises while its university is moving."""
+        model = type(obj)
+        if model in self.roots:
+            university = getattr(obj, self.roots[model])
+            self.check_writable(university)
+            key = inspect(obj).key
+            return key[2] if key is not None else self.shard_for_university(university)
+        parent_model, foreign_key = self.parents[model]
+        parent = session.get(parent_model, getattr(obj, foreign_key))
+        if parent is None:
+            raise ShardingError(f'{model.__name__} refers to missing {parent_model.__name__} {getattr(obj, foreign_key)}')
+        return self.write_shard(session, parent)
+
+    # --- ids ---
+
+    def next_id(self, conn, table):
+        """Next id for a sharded table, from the sequence row on the primary.
+
+        `conn` is the flushing session's connection to the primary, so the bump is
+        part of its transaction: a separate transaction would wait forever on the
+        SQLite write lock that session already holds.
+        """
+        seq = self.id_sequence.__table__
+        for _attempt in range(3):
+            try:
+                with conn.begin_nested():
+                    bumped = conn.execute(update(seq).where(seq.c.name == table).values(next_id=seq.c.next_id + 1))
+                    if bumped.rowcount:
+                        return conn.execute(select(seq.c.next_id - 1).where(seq.c.name == table)).scalar_one()
+                    # First sharded insert: start above every id already used on any shard
+                    start = self._max_id(conn, table) + 1
+                    conn.execute(insert(seq).values(name=table, next_id=start + 1))
+                    return start
+            except IntegrityError:
+                # Another process created the row first; bump it instead
+                continue
+        raise ShardingError(f'Could not allocate an id for {table}')
+
+    def _max_id(self, conn, table):
+        column = self.db.metadata.tables[table].c.id
+        highest = conn.execute(select(func.max(column))).scalar() or 0
+        for name in self.engines:
+            with self.engine(name).connect() as shard:
+                highest = max(highest, shard.execute(select(func.max(column))).scalar() or 0)
+        return highest
+
+    # --- schema ---
+
+    def shard_metadata(self):
+        """Copies of the sharded tables without foreign keys to tables that stay on the primary."""
+        metadata = MetaData()
+        for table in self.db.metadata.sorted_tables:
+            if table.name in self.tables:
+                table.to_metadata(metadata)
+        for table in metadata.tables.values():
+            for fk in [c for c in table.constraints if isinstance(c, ForeignKeyConstraint)]:
+                if fk.elements[0].target_fullname.split('.')[0] not in self.tables:
+                    table.constraints.discard(fk)
+                    for element in fk.elements:
+                        element.parent.foreign_keys.discard(element)
+                        table.foreign_keys.discard(element)
+        return metadata
+
+    def create_all(self):
+        """Create or update the sharded tables and their indexes on every configured shard."""
+        metadata = self.shard_metadata()
+        return {name: sync_schema(self.engine(name), metadata) for name in self.engines}
+
+    # --- moving universities ---
+
+    def _set_map(self, key, shard, moving):
+        T = self.shard_map.__table__
+        with self.db.engine.begin() as conn:
+            conn.execute(delete(T).where(T.c.university_key == key))
+            conn.execute(insert(T).values(university_key=key, shard=shard, moving=moving))
+        self._map = None
+
+    def _rows_to_move(self, conn, key):
+        """{model: ids} of everything belonging to a university, parents before children."""
+        ids = {}
+        for model, attr in self.roots.items():
+            matches = func.lower(func.trim(func.coalesce(getattr(model, attr), ''))) == key
+            ids[model] = conn.execute(select(model.id).where(matches)).scalars().all()
+        pending = dict(self.parents)
+        while pending:
+            ready = [model for model, (parent, _fk) in pending.items() if parent in ids]
+            if not ready:
+                raise ShardingError(f'Sharded models without a registered parent: {sorted(m.__name__ for m in pending)}')
+            for model in ready:
+                parent, foreign_key = pending.pop(model)
+                ids[model] = []
+                for chunk in chunks(ids[parent]):
+                    ids[model] += conn.execute(select(model.id).where(getattr(model, foreign_key).in_(chunk))).scalars().all()
+        return ids
+
+    def move_university(self, university, target, wait=None, log=lambda message: None):
+        """Copy a university's rows to `target`, switch the map over, then delete the originals.
+
+        Writes for the university are refused (UniversityMoving -> HTTP 503) for the
+        duration. Reads keep working: while both shards hold the rows, merged reads
+        drop the copy on the shard the map doesn't point at (see stale_rows). `wait`
+        defaults to SHARD_MAP_TTL so every worker has seen the pause before rows are
+        copied. Returns {table: rows moved}.
+        """
+        key = university_key(university)
+        self.engine(target)
+        self._map = None
+        source = self.shard_for_university(key)
+        if source == target:
+            return {}
+        wait = self.map_ttl if wait is None else wait
+
+        self._set_map(key, source, moving=True)
+        log(f'Paused writes for {key!r}; waiting {wait}s for workers to notice.')
+        time.sleep(wait)
+
+        moved = {}
+        with self.engine(source).connect() as src, self.engine(target).begin() as dst:
+            plan = self._rows_to_move(src, key)
+            for model, ids in plan.items():
+                table = model.__table__
+                local = model in self.local_ids
+                if local:
+                    # Ids repeat across shards, so clear leftovers by parent and let the target number the copies
+                    parent, foreign_key = self.parents[model]
+                    for chunk in chunks(plan[parent]):
+                        dst.execute(delete(table).where(table.c[foreign_key].in_(chunk)))
+                for chunk in chunks(ids):
+                    if not local:
+                        # Leftovers from an interrupted earlier move would collide on the id
+                        dst.execute(delete(table).where(table.c.id.in_(chunk)))
+                    rows = src.execute(select(table).where(table.c.id.in_(chunk))).mappings().all()
+                    dst.execute(insert(table), [{c: v for c, v in row.items() if not (local and c == 'id')}
+                                                for row in rows])
+                moved[table.name] = len(ids)
+                log(f'Copied {len(ids)} {table.name} row(s) to {target}.')
+        # Still paused: a worker sees (source, moving) or (target, moving) until the
+        # originals are gone, so it never writes to a stale shard and keeps filtering reads
+        self._set_map(key, target, moving=True)
+        with self.engine(source).begin() as src:
+            for model, ids in reversed(plan.items()):
+                table = model.__table__
+                for chunk in chunks(ids):
+                    src.execute(delete(table).where(table.c.id.in_(chunk)))
+        log(f'Removed the originals from {source}.')
+        self._set_map(key, target, moving=False)
+        return moved
+
+
+def chunks(ids, size=500):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
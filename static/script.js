@@ -70,3 +70,113 @@ function vote(reviewId, voteType) {
         console.error('Error voting:', error);
     });
 }
+
+// "Did you mean" suggestions under a professor name field. onPick (optional) is
+// called with the chosen professor; without it the suggestions link to their pages.
+function suggestProfessors(nameInput, universityInput, listEl, onPick) {
+    if (!nameInput || !listEl) return;
+    let timer = null;
+    const update = () => {
+        const name = nameInput.value.trim();
+        if (name.length < 3) {
+            listEl.innerHTML = '';
+            return;
+        }
+        const university = universityInput ? universityInput.value.trim() : '';
+        fetch(`/api/professors/suggest?name=${encodeURIComponent(name)}&university=${encodeURIComponent(university)}`)
+            .then(r => r.json())
+            .then(data => {
+                listEl.innerHTML = '';
+                if (!data.length) return;
+                const label = document.createElement('small');
+                label.className = 'text-muted d-block';
+                label.textContent = 'Did you mean:';
+                listEl.appendChild(label);
+                data.forEach(p => {
+                    const link = document.createElement('a');
+                    link.href = `/professor/${p.id}`;
+                    link.className = 'd-block';
+                    link.textContent = `${p.name} (${p.university || 'unknown university'})`;
+                    if (onPick) {
+                        link.addEventListener('click', e => {
+                            e.preventDefault();
+                            onPick(p);
+                        });
+                    }
+                    listEl.appendChild(link);
+                });
+            }).catch(err => {
+                console.error(err);
+            });
+    };
+    const schedule = () => {
+        clearTimeout(timer);
+        timer = setTimeout(update, 250);
+    };
+    nameInput.addEventListener('input', schedule);
+    if (universityInput) universityInput.addEventListener('input', schedule);
+}
+
+// Live professor dashboard: listens on the container's data-stream-url and adds
+// new reviews and replies as they are posted, keeping the totals current.
+function followDashboard(container) {
+    if (!container || !window.EventSource) return;
+    const source = new EventSource(container.dataset.streamUrl);
+
+    function line(text, className) {
+        const el = document.createElement('div');
+        if (className) el.className = className;
+        el.textContent = text;
+        return el;
+    }
+
+    source.addEventListener('review', e => {
+        const review = JSON.parse(e.data);
+        if (document.getElementById(`review-${review.id}`)) return;
+        const noReviews = document.getElementById('no-reviews');
+        if (noReviews) noReviews.remove();
+
+        const card = document.createElement('div');
+        card.className = 'card mb-2 border-success';
+        card.id = `review-${review.id}`;
+        const body = document.createElement('div');
+        body.className = 'card-body';
+        const title = document.createElement('strong');
+        title.textContent = `Course: ${review.course_code}`;
+        const rating = document.createElement('span');
+        rating.className = 'badge bg-primary ms-2';
+        rating.textContent = `Rating: ${review.rating}/5`;
+        const badge = document.createElement('span');
+        badge.className = 'badge bg-success ms-2';
+        badge.textContent = 'New';
+        body.append(title, rating, badge);
+        const comment = document.createElement('p');
+        comment.textContent = review.comment || '';
+        body.append(comment);
+        if (review.semester && review.year) body.append(line(`Semester: ${review.semester} ${review.year}`, 'small text-muted'));
+        if (review.grade) body.append(line(`Grade Received: ${review.grade}`, 'small text-muted'));
+        body.append(line('By: Anonymous', 'small'));
+        card.append(body);
+        container.prepend(card);
+    });
+
+    source.addEventListener('reply', e => {
+        const reply = JSON.parse(e.data);
+        const card = document.getElementById(`review-${reply.review_id}`);
+        if (card) card.querySelector('.card-body').append(line(`Reply: ${reply.comment}`, 'border rounded p-2 mt-2 bg-light'));
+    });
+
+    source.addEventListener('review_deleted', e => {
+        const card = document.getElementById(`review-${JSON.parse(e.data).id}`);
+        if (card) card.remove();
+    });
+
+    source.addEventListener('aggregates', e => {
+        const totals = JSON.parse(e.data);
+        document.getElementById('avg-rating').textContent = totals.avg_rating;
+        document.getElementById('review-count').textContent = totals.review_count;
+    });
+
+    // Too many events arrived while we were away; the page is the source of truth
+    source.addEventListener('resync', () => window.location.reload());
+}
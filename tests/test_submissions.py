@@ -0,0 +1,46 @@
+import pytest
+
+import app as app_module
+from app import create_app, db, init_db, Professor, Review
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}',
+        'CATALOG_SNAPSHOT_PATH': str(tmp_path / 'catalog.snapshot'),
+        'TESTING': True,
+    })
+    with app.app_context():
+        init_db()
+    return app
+
+
+def rate_new_professor(client, key):
+    return client.post('/rate_class', data={
+        'submission_key': key, 'course': '__other__', 'course_other': 'CS 500', 'rating': '5',
+        'professor_id': 'new', 'prof_name': 'Grace Hopper', 'university': 'Yale', 'confirm_new': '1',
+    })
+
+
+def test_resubmit_with_new_professor_creates_one_professor(app, monkeypatch):
+    client = app.test_client()
+    assert rate_new_professor(client, 'double-click').status_code == 302
+
+    # A double click: the second submit checks its key before the first one has committed
+    real_submitted_review = app_module.submitted_review
+    calls = []
+
+    def submitted_review(model, key):
+        calls.append(key)
+        return None if len(calls) == 1 else real_submitted_review(model, key)
+
+    monkeypatch.setattr(app_module, 'submitted_review', submitted_review)
+    response = rate_new_professor(client, 'double-click')
+    assert response.status_code == 302
+
+    with app.app_context():
+        assert Professor.query.filter_by(name='Grace Hopper').count() == 1
+        assert Review.query.filter_by(submission_key='double-click').count() == 1
+        professor = Professor.query.filter_by(name='Grace Hopper').one()
+    assert response.headers['Location'].endswith(f'/professor/{professor.id}')